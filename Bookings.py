@@ -1,191 +1,179 @@
 import os
-import logging
 import pandas as pd
-from datetime import datetime
-from google.cloud import bigquery
-from google.oauth2.service_account import Credentials  # Correct import for Google Cloud authentication
 import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+from gspread.utils import rowcol_to_a1
+import archive
+from bq_loader import WRITE_MODE, get_credentials, merge_dataframe, write_dataframe
+from instrumentation import span, write_report
+from logging_utils import print_and_log
+from state_utils import load_json_state, save_json_state
+
+# Open the sheet by key to skip the Drive search that opening by name costs
+SHEET_KEY = os.getenv('BOOKINGS_SHEET_KEY')
+SHEET_NAME = "Logs 2024"
+
+# Remembers the sheet's modified time and the last row already processed
+STATE_FILE = os.getenv('BOOKINGS_STATE_FILE', os.path.join('state', 'bookings_sync.json'))
+
+# Rows before the last processed one that are re-read to pick up recent edits
+REREAD_ROWS = int(os.getenv('BOOKINGS_REREAD_ROWS', '50'))
+
+# Define expected headers to resolve header duplication issues
+EXPECTED_HEADERS = ['Date', 'Time', 'Adult', 'Child', 'Under 4', 'Name', 'Contact']
+
+# Function to open the bookings spreadsheet
+def open_bookings_spreadsheet():
+    # Authenticate with the shared service account credentials, which include the Sheets and Drive scopes
+    client = gspread.authorize(get_credentials())
+    if SHEET_KEY:
+        return client.open_by_key(SHEET_KEY)
+    print_and_log(f"BOOKINGS_SHEET_KEY is not set, opening '{SHEET_NAME}' by name.")
+    return client.open(SHEET_NAME)
+
+# Function to read the raw booking rows from start_row onwards in one batch request
+# Returns a DataFrame with the expected headers and the last sheet row that was read
+def read_booking_rows(sheet, start_row):
+    end_column = rowcol_to_a1(1, sheet.col_count).rstrip('1')
+    header_range, rows_range = sheet.batch_get([f"A1:{end_column}1", f"A{start_row}:{end_column}"])
+
+    # Locate each expected header by its first occurrence, duplicated headers are ignored
+    header = header_range[0] if header_range else []
+    positions = {}
+    for position, name in enumerate(header):
+        if name in EXPECTED_HEADERS and name not in positions:
+            positions[name] = position
+    missing = [name for name in EXPECTED_HEADERS if name not in positions]
+    if missing:
+        raise ValueError(f"Bookings sheet is missing the headers {missing}")
+
+    rows = [row + [''] * (len(header) - len(row)) for row in rows_range]
+    data = [[row[positions[name]] for name in EXPECTED_HEADERS] for row in rows]
+    return pd.DataFrame(data, columns=EXPECTED_HEADERS), start_row + len(rows) - 1
+
+# Contact labels for the stripped, lower-cased values
+CONTACT_LABELS = {
+    'email': 'Email',
+    'insta': 'Insta',
+    'call': 'Call',
+    'walk in': 'Walk In',
+    'whatsapp': 'WhatsApp',
+    'in person': 'In Person',
+    'phone': 'Phone',
+}
+
+# Columns loaded to BigQuery, in order
+REQUIRED_COLUMNS = ['Date', 'Time', 'Adult', 'Child', 'Under_4', 'Name', 'Contact']
+
+def remove_whitespace(series):
+    """Remove all whitespace from the text values of a column, leaving other values untouched."""
+    stripped = series.str.replace(r'\s+', '', regex=True)
+    return stripped.where(stripped.notna(), series)
+
+def map_unique(series, func):
+    """Apply a column transform to the distinct values only and broadcast the result back.
+
+    Sheet columns repeat a small set of values, so this turns per-row parsing into per-value parsing.
+    """
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    mapped = func(pd.Series(uniques, dtype=object))
+    return pd.Series(mapped.to_numpy()[codes], index=series.index)
+
+def to_count(series):
+    return pd.to_numeric(series, errors='coerce').fillna(0).astype(int)
+
+def clean_bookings(df):
+    """Type, validate and normalise raw booking rows. Pure: returns a new DataFrame."""
+    df = pd.DataFrame({
+        'Date': map_unique(df['Date'], lambda values: pd.to_datetime(values, format='%d.%m.%y', errors='coerce')),
+        'Time': map_unique(df['Time'], lambda values: pd.to_datetime(values, format='%H:%M', errors='coerce').dt.time),
+        'Adult': map_unique(df['Adult'], to_count),
+        'Child': map_unique(df['Child'], to_count),
+        'Under_4': map_unique(df['Under 4'], to_count),
+        'Name': df['Name'],
+        'Contact': map_unique(df['Contact'], lambda values: values.str.strip().str.lower().replace(CONTACT_LABELS)),
+    })
+
+    # Remove rows with invalid data or an empty contact in one pass
+    df = df[df['Date'].notna() & df['Time'].notna() & (df['Adult'] >= 1) & (df['Contact'] != "")]
 
-# Set up logging
-log_file = 'script_output.log'
-logging.basicConfig(filename=log_file, level=logging.DEBUG, format='%(message)s')
+    # Remove duplicate rows based on all columns
+    df = df.drop_duplicates()
 
-def print_and_log(message):
-    print(message)
-    logging.debug(message)
+    # Strip all whitespace from the text columns, contacts only take a handful of values
+    return df.assign(
+        Name=map_unique(df['Name'], remove_whitespace),
+        Contact=map_unique(df['Contact'], remove_whitespace).astype('category'),
+    )[REQUIRED_COLUMNS]
 
 # Function to process and clean the bookings data
-def process_bookings():
-    # Define the scopes needed for Google Sheets and Drive
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-
-    # Use the service account credentials
-    creds = ServiceAccountCredentials.from_json_keyfile_name(os.getenv('GOOGLE_APPLICATION_CREDENTIALS'), scope)
-
-    # Authenticate and open the Google Sheet
-    client = gspread.authorize(creds)
-    spreadsheet = client.open("Logs 2024")
-    sheet = spreadsheet.worksheet("Bookings")
-
-    # Define expected headers to resolve header duplication issues
-    expected_headers = ['Date', 'Time', 'Adult', 'Child', 'Under 4', 'Name', 'Contact']
-
-    # Get all the data from the 'Bookings' tab using expected headers
-    data = sheet.get_all_records(expected_headers=expected_headers)
-
-    # Convert the data to a DataFrame for easier analysis
-    df = pd.DataFrame(data)
-
-    # Convert columns
-    df['Date'] = pd.to_datetime(df['Date'], format='%d.%m.%y', dayfirst=True, errors='coerce')
-    df['Time'] = pd.to_datetime(df['Time'], format='%H:%M', errors='coerce').dt.time
-    df['Adult'] = pd.to_numeric(df['Adult'], errors='coerce').fillna(0).astype(int)
-    df['Child'] = pd.to_numeric(df['Child'], errors='coerce').fillna(0).astype(int)
-    df['Under 4'] = pd.to_numeric(df['Under 4'], errors='coerce').fillna(0).astype(int)
-
-    # Rename the 'Under 4' column to 'Under_4'
-    df.rename(columns={'Under 4': 'Under_4'}, inplace=True)
-
-    # Remove rows with invalid data
-    df = df[df['Date'].notna() & df['Time'].notna() & (df['Adult'] >= 1)]
-
-    # Clean the 'Contact' column
-    df['Contact'] = df['Contact'].str.strip().str.lower().replace({
-        'email': 'Email', 
-        'insta': 'Insta', 
-        'call': 'Call', 
-        'walk in': 'Walk In', 
-        'whatsapp': 'WhatsApp', 
-        'in person': 'In Person',
-        'phone': 'Phone'
-    })
+def process_bookings(sheet, start_row=2):
+    # Get the data from the 'Bookings' tab, only from start_row onwards
+    with span('bookings.fetch') as stage:
+        df, last_row = read_booking_rows(sheet, start_row)
+        stage.add(rows=len(df), api_calls=1)
 
-    # Remove empty or invalid contacts
-    df = df[df['Contact'] != ""]
+    with span('bookings.transform') as stage:
+        raw_rows = len(df)
+        df = clean_bookings(df)
+        stage.add(rows=len(df), bytes=df.memory_usage(deep=True).sum())
 
-    # Remove duplicate rows based on all columns
-    df.drop_duplicates(inplace=True)
-
-    # Ensure the DataFrame only contains the specified columns
-    required_columns = ['Date', 'Time', 'Adult', 'Child', 'Under_4', 'Name', 'Contact']
-    df = df[required_columns]
-
-    # Function to remove all whitespace from string values
-    def remove_whitespace_from_series(series):
-        if series.dtype == 'object':
-            return series.apply(lambda x: ''.join(x.split()) if isinstance(x, str) else x)
-        return series
-
-    # Apply the function to each column
-    df = df.apply(remove_whitespace_from_series)
-
-    print_and_log(df)
-
-    # Directory where you want to save the CSV file
-    save_directory = os.getenv('CSV_SAVE_DIRECTORY', 'data')
-
-    # Define the CSV filename
-    csv_filename = f"Bookings_{datetime.now().strftime('%Y%m%d')}.csv"
-
-    # Generate the full file path
-    full_path = os.path.join(save_directory, csv_filename)
-
-    # Write the DataFrame to a CSV file with proper formatting
-    os.makedirs(save_directory, exist_ok=True)
-    df.to_csv(full_path, index=False)
-
-    print_and_log(f"Bookings exported to {full_path}")
-
-    return full_path
-
-def upload_csv_to_bigquery(csv_path):
-    # Use credentials file specified in GOOGLE_APPLICATION_CREDENTIALS environment variable
-    credentials_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
-    if not os.path.exists(credentials_path):
-        print_and_log(f"Credentials file {credentials_path} not found.")
-        exit(1)
-
-    # Create BigQuery client using the credentials file
-    credentials = Credentials.from_service_account_file(credentials_path)
-    client = bigquery.Client(credentials=credentials, project='sumup-integration')
-
-    dataset_id = 'Bookings'  # Your dataset ID
-    table_id = 'BookingsTable'  # Only the table name
-    table_ref = client.dataset(dataset_id).table(table_id)
-
-    job_config = bigquery.LoadJobConfig(
-        schema=[
-            bigquery.SchemaField("Date", "DATE"),
-            bigquery.SchemaField("Time", "TIME"),
-            bigquery.SchemaField("Adult", "INTEGER"),
-            bigquery.SchemaField("Child", "INTEGER"),
-            bigquery.SchemaField("Under_4", "INTEGER"),
-            bigquery.SchemaField("Name", "STRING"),
-            bigquery.SchemaField("Contact", "STRING"),
-        ],
-        skip_leading_rows=1,
-        source_format=bigquery.SourceFormat.CSV,
-        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE  # Overwrite the table data with new data
-    )
+    print_and_log(f"Read {raw_rows} booking rows, {len(df)} valid after cleaning.")
 
-    try:
-        with open(csv_path, "rb") as source_file:
-            job = client.load_table_from_file(source_file, table_ref, job_config=job_config)
-        
-        # Wait for the load job to complete
-        job.result()
-
-        # Log job details
-        log_bigquery_job_details(job)
-        
-    except Exception as e:
-        print_and_log(f"Failed to upload data to BigQuery: {e}")
-        raise
-
-def log_bigquery_job_details(job):
-    # Convert job to API representation
-    job_details = job.to_api_repr()
-
-    # Log raw job details for debugging
-    print_and_log(f"Raw job details: {job_details}")
-
-    # Log job details
-    print_and_log(f"Data loaded into BigQuery table '{job_details.get('destinationTable', {}).get('tableId', 'Unknown Table')}'.")
-    print_and_log(f"Load job status: {job_details.get('status', {}).get('state', 'UNKNOWN')}")
-
-    if 'errorResult' in job_details:
-        print_and_log(f"Job failed with errors: {job_details['errorResult']}")
-    
-    if 'statistics' in job_details:
-        statistics = job_details['statistics']
-        print_and_log(f"Total rows: {statistics.get('totalRows', 'UNKNOWN')}")
-        print_and_log(f"Total bytes processed: {statistics.get('totalBytesProcessed', 'UNKNOWN')}")
-        print_and_log(f"Total bytes billed: {statistics.get('totalBytesBilled', 'UNKNOWN')}")
-    
-    if 'configuration' in job_details and 'load' in job_details['configuration']:
-        load_config = job_details['configuration']['load']
-        print_and_log(f"Source URIs: {load_config.get('sourceUris', 'UNKNOWN')}")
+    return df, last_row
 
 # Main script execution
-def main():
-    csv_path = process_bookings()
-
-    if csv_path:
-        upload_csv_to_bigquery(csv_path)
-        print_last_10_csv_rows(csv_path)
-
-def print_last_10_csv_rows(csv_path):
-    if os.path.exists(csv_path):
-        df = pd.read_csv(csv_path)
-        # Ensure only the relevant columns are present
-        if all(col in df.columns for col in ['Date', 'Time', 'Adult', 'Child', 'Under_4', 'Name', 'Contact']):
-            print_and_log(f"\nMost recent 10 rows in the CSV file {csv_path}:")
-            print_and_log(df[['Date', 'Time', 'Adult', 'Child', 'Under_4', 'Name', 'Contact']].tail(10).to_string(index=False))
+# since re-reads the whole sheet and re-loads the bookings dated from then on
+# Returns the earliest booking date that was loaded, or None when nothing was
+def main(since=None):
+    state = load_json_state(STATE_FILE, {})
+    spreadsheet = open_bookings_spreadsheet()
+
+    # Skip the run entirely when the sheet has not changed since the last sync
+    modified_time = spreadsheet.get_lastUpdateTime()
+    unchanged = state.get('spreadsheet_id') == spreadsheet.id and state.get('modified_time') == modified_time
+    if unchanged and since is None:
+        print_and_log(f"Bookings sheet unchanged since {modified_time}, nothing to do.")
+        return None
+
+    # Read only the rows appended since the last sync, plus a few before them to catch recent edits
+    # A truncating write replaces the whole table, so it always needs the whole sheet
+    full_refresh = (
+        state.get('spreadsheet_id') != spreadsheet.id
+        or os.getenv('BOOKINGS_FULL_REFRESH') == '1'
+        or WRITE_MODE == 'truncate'
+        or since is not None
+    )
+    start_row = 2 if full_refresh else max(2, state['last_row'] + 1 - REREAD_ROWS)
+    print_and_log(f"Reading bookings from row {start_row} ({'full' if full_refresh else 'incremental'} sync).")
+
+    df, last_row = process_bookings(spreadsheet.worksheet("Bookings"), start_row)
+    if since is not None:
+        df = df[df['Date'] >= pd.Timestamp(since)]
+
+    if not df.empty:
+        # Upsert the typed DataFrame directly
+        # A full read is a snapshot of the sheet, so bookings removed from it are removed from the table too
+        if since is not None:
+            # A re-sync holds only the bookings from since, so it is merged whatever the write mode
+            merge_dataframe(df, 'bookings', delete_missing=True, min_date=since)
         else:
-            print_and_log("The CSV file does not contain the required columns.")
+            write_dataframe(df, 'bookings', delete_missing=full_refresh)
+
+        # The archive months a full read covers are replaced the same way
+        with span('bookings.archive') as stage:
+            stage.add(rows=len(df))
+            archive.append('bookings', df, replace=full_refresh and since is None)
+        archive.print_tail('bookings')
     else:
-        print_and_log(f"CSV file {csv_path} does not exist.")
+        print_and_log("No new bookings to upload.")
+
+    save_json_state(STATE_FILE, {
+        'spreadsheet_id': spreadsheet.id,
+        'modified_time': modified_time,
+        'last_row': max(last_row, state.get('last_row', 1) if not full_refresh else 1),
+    })
+    return df['Date'].min().date() if not df.empty else None
 
 if __name__ == "__main__":
     main()
+    print_and_log(f"Run report written to {write_report()}")
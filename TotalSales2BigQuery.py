@@ -1,191 +1,222 @@
-import os
-import logging
-import requests
-import pandas as pd
-from datetime import datetime, timezone
-from google.cloud import bigquery
-from google.api_core.exceptions import GoogleAPIError
-from google.oauth2.service_account import Credentials
-
-# Set up logging
-log_file = 'script_output.log'
-logging.basicConfig(filename=log_file, level=logging.DEBUG, format='%(message)s')
-
-def print_and_log(message):
-    print(message)
-    logging.debug(message)
-
-# Function to fetch transactions from SumUp API
-def fetch_transactions(api_key, start_date, end_date):
-    BASE_URL = 'https://api.sumup.com/v0.1'
-    headers = {'Authorization': f'Bearer {api_key}'}
-    endpoint = f'{BASE_URL}/me/transactions/history'
-    params = {'from': start_date.strftime('%Y-%m-%d'), 'to': end_date.strftime('%Y-%m-%d')}
-    all_transactions = []
-
-    while True:
-        response = requests.get(endpoint, headers=headers, params=params)
-        if response.status_code == 200:
-            transactions_response = response.json()
-            if 'items' in transactions_response:
-                transactions = transactions_response['items']
-                all_transactions.extend(transactions)
-                print_and_log(f"Fetched {len(transactions)} transactions.")
-
-            else:
-                print_and_log("The 'items' key was not found in the response.")
-                break
-
-            next_link = next((link for link in transactions_response.get('links', []) if link['rel'] == 'next'), None)
-            if next_link:
-                # Properly construct the full URL for the next request
-                endpoint = f"{BASE_URL}/me/transactions/history?{next_link['href']}"
-                params = {}  # Clear params to avoid duplication in the URL
-            else:
-                break
-        else:
-            print_and_log(f"Failed to retrieve transactions. Status code: {response.status_code}")
-            print_and_log("Response: " + response.text)
-            break
-
-    print_and_log(f"Total transactions fetched: {len(all_transactions)}")
-    return all_transactions
-
-# Function to save transactions to a CSV file
-def save_transactions_to_csv(transactions, save_directory):
-    if transactions:
-        start_date = datetime(2023, 12, 3, tzinfo=timezone.utc)  # Ensure dates are correct
-        end_date = datetime.now(timezone.utc)
-
-        df = pd.DataFrame(transactions)
-        
-        # Convert timestamp to datetime and then to BST if it's timezone-aware
-        df['timestamp'] = pd.to_datetime(df['timestamp']).dt.tz_localize(None)  # Remove any existing timezone info
-        df['timestamp'] = pd.to_datetime(df['timestamp']).dt.tz_localize('UTC').dt.tz_convert('Europe/London')
-        
-        # Filter transactions based on amount and time
-        df = df[df['status'] == 'SUCCESSFUL']
-        df = df[(df['timestamp'] >= start_date) & (df['timestamp'] <= end_date)]
-        
-        # Drop duplicates
-        df.drop_duplicates(inplace=True)
-        
-        # Extract date and time details
-        df['date'] = df['timestamp'].dt.strftime('%Y-%m-%d')
-        df['time'] = df['timestamp'].dt.strftime('%H:%M:%S')
-        df['day_of_week'] = df['timestamp'].dt.strftime('%A')
-        df = df[['date', 'time', 'day_of_week', 'amount']]
-        
-        os.makedirs(save_directory, exist_ok=True)
-        csv_filename = f"TotalSales_{datetime.now().strftime('%Y%m%d')}.csv"
-        full_path = os.path.join(save_directory, csv_filename)
-        df.to_csv(full_path, index=False)
-
-        if os.path.exists(full_path):
-            print_and_log(f"Transactions exported to {full_path}")
-            print_and_log(f"File size: {os.path.getsize(full_path)} bytes")
-        else:
-            print_and_log("CSV file was not created successfully.")
-        
-        return full_path
-    else:
-        print_and_log("No transactions found for the specified date range.")
-        return None
-
-def print_last_10_csv_rows(csv_path):
-    if os.path.exists(csv_path):
-        df = pd.read_csv(csv_path)
-        # Ensure only the relevant columns are present
-        if all(col in df.columns for col in ['date', 'time', 'day_of_week', 'amount']):
-            print_and_log(f"\nMost recent 10 rows in the CSV file {csv_path}:")
-            print_and_log(df[['date', 'time', 'day_of_week', 'amount']].tail(10).to_string(index=False))
-        else:
-            print_and_log("The CSV file does not contain the required columns.")
-    else:
-        print_and_log(f"CSV file {csv_path} does not exist.")
-
-# Function to upload CSV to BigQuery and log job details
-def upload_csv_to_bigquery(csv_path):
-    # Use credentials file specified in GOOGLE_APPLICATION_CREDENTIALS environment variable
-    credentials_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
-    if not os.path.exists(credentials_path):
-        print_and_log(f"Credentials file {credentials_path} not found.")
-        exit(1)
-
-    # Create BigQuery client using the credentials file
-    credentials = Credentials.from_service_account_file(credentials_path)
-    client = bigquery.Client(credentials=credentials, project='sumup-integration')
-
-    dataset_id = 'TotalSales'  # Your dataset ID
-    table_id = 'TotalSalesTable'  # Only the table name
-    table_ref = client.dataset(dataset_id).table(table_id)
-
-    job_config = bigquery.LoadJobConfig(
-        schema=[
-            bigquery.SchemaField("date", "DATE"),
-            bigquery.SchemaField("time", "TIME"),
-            bigquery.SchemaField("day_of_week", "STRING"),
-            bigquery.SchemaField("amount", "FLOAT64"),
-        ],
-        skip_leading_rows=1,
-        source_format=bigquery.SourceFormat.CSV,
-        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE  # Overwrite the table data with new data
-    )
-
-    try:
-        with open(csv_path, "rb") as source_file:
-            job = client.load_table_from_file(source_file, table_ref, job_config=job_config)
-        
-        # Wait for the load job to complete
-        job.result()
-
-        # Log job details
-        log_bigquery_job_details(job)
-        
-    except GoogleAPIError as e:
-        print_and_log(f"Failed to upload data to BigQuery: {e}")
-        raise
-
-def log_bigquery_job_details(job):
-    # Convert job to API representation
-    job_details = job.to_api_repr()
-
-    # Log raw job details for debugging
-    print_and_log(f"Raw job details: {job_details}")
-
-    # Log job details
-    print_and_log(f"Data loaded into BigQuery table '{job_details.get('destinationTable', {}).get('tableId', 'Unknown Table')}'.")
-    print_and_log(f"Load job status: {job_details.get('status', {}).get('state', 'UNKNOWN')}")
-
-    if 'errorResult' in job_details:
-        print_and_log(f"Job failed with errors: {job_details['errorResult']}")
-    
-    if 'statistics' in job_details:
-        statistics = job_details['statistics']
-        print_and_log(f"Total rows: {statistics.get('totalRows', 'UNKNOWN')}")
-        print_and_log(f"Total bytes processed: {statistics.get('totalBytesProcessed', 'UNKNOWN')}")
-        print_and_log(f"Total bytes billed: {statistics.get('totalBytesBilled', 'UNKNOWN')}")
-    
-    if 'configuration' in job_details and 'load' in job_details['configuration']:
-        load_config = job_details['configuration']['load']
-        print_and_log(f"Source URIs: {load_config.get('sourceUris', 'UNKNOWN')}")
-
-# Main script execution
-def main():
-    api_key = os.getenv('SUMUP_API_KEY')
-    if not api_key:
-        print_and_log("API key is missing.")
-        exit(1)
-
-    start_date = datetime(2023, 12, 3, tzinfo=timezone.utc)
-    end_date = datetime.now(timezone.utc)
-
-    transactions = fetch_transactions(api_key, start_date, end_date)
-    csv_path = save_transactions_to_csv(transactions, 'data')
-
-    if csv_path:
-        upload_csv_to_bigquery(csv_path)
-        print_last_10_csv_rows(csv_path)
-
-if __name__ == "__main__":
-    main()
+import os
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+from instrumentation import Span, span, write_report
+from logging_utils import print_and_log
+from state_utils import load_json_state, save_json_state
+from sumup_client import MAX_WORKERS, SHARD_DAYS, SumUpClient
+from transactions import parse_page, parse_utc, to_arrow
+
+# pandas, pyarrow and the BigQuery client are imported inside the functions that use them,
+# so a scheduled run that finds no new sales exits before paying for them
+
+# Earliest date we sync sales from
+SYNC_START_DATE = datetime(2023, 12, 3, tzinfo=timezone.utc)
+
+# Ask SumUp for its newest transaction first and stop when it is not past the watermark
+PROBE = os.getenv('SALES_PROBE', '1') == '1'
+
+# Persisted high-water mark so each run only fetches the new window
+STATE_FILE = os.getenv('SALES_STATE_FILE', os.path.join('state', 'sales_watermark.json'))
+
+# Re-fetch this much history before the watermark to catch late-settling transactions
+OVERLAP = timedelta(hours=int(os.getenv('SALES_OVERLAP_HOURS', '48')))
+
+# Normalise a SumUp timestamp to a sortable UTC ISO string
+def parse_timestamp(value):
+    return parse_utc(value).isoformat(timespec='microseconds')
+
+# Function to check whether SumUp has any transaction newer than the watermark, with a single one-item request
+def has_new_transactions(client, watermark):
+    latest = client.latest_transaction()
+    if latest is None or not latest.get('timestamp'):
+        return False
+    newest = parse_timestamp(latest['timestamp'])
+    if newest != watermark['last_timestamp']:
+        return newest > watermark['last_timestamp']
+    # The watermark id follows the newest item of any status, recent_ids only the loaded ones
+    if latest.get('id') == watermark.get('last_transaction_id'):
+        # A pending sale that settles keeps its id and timestamp, only its status moves on
+        return latest.get('status') != watermark.get('last_status')
+    return latest.get('id') not in watermark.get('recent_ids', {})
+
+# Function to move the watermark forward past the transactions we just processed
+# newest is the (timestamp, id, status) of the newest fetched transaction, uploaded maps loaded ids to their timestamps
+def advance_watermark(watermark, newest, uploaded):
+    watermark = dict(watermark or {})
+    if newest is None:
+        return watermark
+
+    last_timestamp, last_id, last_status = newest
+    if watermark.get('last_timestamp') and watermark['last_timestamp'] > last_timestamp:
+        last_timestamp, last_id = watermark['last_timestamp'], watermark.get('last_transaction_id')
+        last_status = watermark.get('last_status')
+
+    # Remember the ids already loaded inside the overlap so re-fetched rows are not appended twice
+    cutoff = (datetime.fromisoformat(last_timestamp) - OVERLAP).isoformat(timespec='microseconds')
+    recent_ids = {**watermark.get('recent_ids', {}), **uploaded}
+    recent_ids = {tx_id: ts for tx_id, ts in recent_ids.items() if ts >= cutoff}
+
+    watermark.update({
+        'last_timestamp': last_timestamp,
+        'last_transaction_id': last_id,
+        'last_status': last_status,
+        'recent_ids': recent_ids,
+    })
+    return watermark
+
+# Function to stream transaction pages from SumUp API, raises SumUpAPIError rather than yielding a partial history
+def iter_transaction_pages(client, start_date, end_date):
+    # Backfills longer than one shard are fetched concurrently, short incremental windows serially
+    if MAX_WORKERS > 1 and end_date - start_date > timedelta(days=SHARD_DAYS):
+        return client.iter_transaction_pages_sharded(start_date, end_date)
+    # Either way the next pages are downloaded while the current one is parsed
+    return client.iter_transaction_pages_prefetched(start_date, end_date)
+
+# Function to stream transactions to a Parquet file page by page
+# Returns the file path (None when nothing new), the uploaded ids and the newest fetched (timestamp, id, status)
+# Fetching, parsing and writing are interleaved, stage records each one's share of the time
+def save_transactions_to_parquet(pages, save_directory, seen_ids=None, stage=None):
+    import pyarrow.parquet as pq
+    from table_schemas import get_arrow_schema
+
+    start_date = SYNC_START_DATE  # Ensure dates are correct
+    end_date = datetime.now(timezone.utc)
+    seen_ids = set(seen_ids or ())
+
+    os.makedirs(save_directory, exist_ok=True)
+    parquet_filename = f"TotalSales_{datetime.now().strftime('%Y%m%d')}.parquet"
+    full_path = os.path.join(save_directory, parquet_filename)
+
+    uploaded = {}
+    newest = None
+    fetched = 0
+    rejected = 0
+    schema = get_arrow_schema('sales')
+    stage = stage or Span('sales.fetch')
+    # Closing the pages stops the fetching threads if writing fails part way through
+    with closing(pages), pq.ParquetWriter(full_path, schema, compression='zstd') as writer:
+        for items in pages:
+            fetched += len(items)
+            # Keep only new successful transactions, parsed into compact records, and drop the raw page
+            with stage.measure('transform'):
+                records, page_newest, page_rejected = parse_page(items, start_date, end_date, seen_ids)
+            rejected += page_rejected
+            if page_newest and (newest is None or page_newest[0] > newest[0]):
+                newest = page_newest
+            if not records:
+                continue
+            uploaded.update((record.id, record.utc_timestamp) for record in records)
+
+            with stage.measure('serialise'):
+                writer.write_table(to_arrow(records, schema))
+
+    print_and_log(f"Total transactions fetched: {fetched}")
+    if rejected:
+        print_and_log(f"Skipped {rejected} malformed transactions.")
+    newest = (newest[0].isoformat(timespec='microseconds'), *newest[1:]) if newest else None
+    if not uploaded:
+        os.remove(full_path)
+        print_and_log("No new successful transactions to upload.")
+        return None, uploaded, newest
+
+    print_and_log(f"{len(uploaded)} transactions exported to {full_path}")
+    print_and_log(f"File size: {os.path.getsize(full_path)} bytes")
+    return full_path, uploaded, newest
+
+# Function to load the run's Parquet file into BigQuery and the local archive
+# Returns the earliest date that was loaded
+def upload_transactions(parquet_path, watermark, since=None):
+    import pandas as pd
+    from google.cloud import bigquery
+    import archive
+    import rollups
+    from bq_loader import WRITE_MODE, load_parquet_file, merge_parquet_file
+    from table_schemas import min_partition_date
+
+    if since is not None:
+        # A re-sync overlaps rows already loaded, so it is always merged
+        merge_parquet_file(parquet_path, 'sales')
+    elif watermark is None:
+        # The first run rebuilds the table from the full history, date partitioned
+        # An unpartitioned table left by an older version is migrated before it is replaced
+        load_parquet_file(parquet_path, 'sales')
+    elif WRITE_MODE == 'merge':
+        # Incremental runs upsert the new window on transaction_id, so retries are safe
+        merge_parquet_file(parquet_path, 'sales')
+    else:
+        load_parquet_file(parquet_path, 'sales', write_disposition=bigquery.WriteDisposition.WRITE_APPEND)
+
+    # Keep the loaded rows in the local archive, the run file is only a load artifact
+    with span('sales.archive') as stage:
+        stage.add(bytes=os.path.getsize(parquet_path))
+        df = pd.read_parquet(parquet_path)
+        stage.add(rows=len(df))
+        archive.append('sales', df)
+    archive.print_tail('sales', columns=['date', 'time', 'day_of_week', 'amount'])
+    loaded_from = min_partition_date(df, 'sales')
+
+    # New transactions refresh the days they fall on, a re-sync or first run rebuilds from the earliest loaded date
+    if since is None and watermark is not None:
+        rollups.update_sales_rollups(df)
+    else:
+        rollups.update_sales_rollups(rebuild_from=loaded_from)
+    os.remove(parquet_path)
+    return loaded_from
+
+# Function to re-check the trailing window for refunds and late arrivals when SALES_RECONCILE_DAYS is set
+# A re-sync already re-fetches everything, so only scheduled runs reconcile
+def reconcile_if_due(since=None):
+    if since is not None:
+        return None
+    import reconcile
+    return reconcile.run_if_due()
+
+# Main script execution
+# since re-syncs every transaction from that date, overriding the watermark
+# Returns the earliest date that was loaded, or None when nothing was
+def main(since=None):
+    api_key = os.getenv('SUMUP_API_KEY')
+    if not api_key:
+        print_and_log("API key is missing.")
+        exit(1)
+
+    watermark = load_json_state(STATE_FILE)
+    if since is not None:
+        start_date = max(datetime(since.year, since.month, since.day, tzinfo=timezone.utc), SYNC_START_DATE)
+        print_and_log(f"Re-syncing sales from {start_date.isoformat()}")
+    elif watermark and watermark.get('last_timestamp'):
+        start_date = max(datetime.fromisoformat(watermark['last_timestamp']) - OVERLAP, SYNC_START_DATE)
+        print_and_log(f"Incremental sync from {start_date.isoformat()} (watermark {watermark['last_timestamp']})")
+    else:
+        watermark = None
+        start_date = SYNC_START_DATE
+        print_and_log(f"No watermark found in {STATE_FILE}, running a full sync from {start_date.isoformat()}")
+    end_date = datetime.now(timezone.utc)
+
+    seen_ids = set(watermark.get('recent_ids', {})) if watermark and since is None else set()
+    with SumUpClient(api_key) as client:
+        # Most scheduled runs find nothing new, one cheap request settles that before any heavy import
+        if PROBE and watermark and since is None:
+            with span('sales.probe') as stage:
+                found = has_new_transactions(client, watermark)
+                stage.add(api_calls=1)
+            if not found:
+                print_and_log(f"No transactions since {watermark['last_timestamp']}, nothing to do.")
+                return reconcile_if_due(since)
+
+        with span('sales.fetch') as stage:
+            pages = iter_transaction_pages(client, start_date, end_date)
+            parquet_path, uploaded, newest = save_transactions_to_parquet(pages, 'data', seen_ids=seen_ids, stage=stage)
+            stage.add(rows=len(uploaded), bytes=sum(client.metrics['bytes_per_page']), api_calls=client.metrics['requests'])
+        client.log_metrics()
+
+    loaded_from = upload_transactions(parquet_path, watermark, since) if parquet_path else None
+
+    save_json_state(STATE_FILE, advance_watermark(watermark, newest, uploaded))
+    reconciled_from = reconcile_if_due(since)
+    return min(filter(None, [loaded_from, reconciled_from]), default=None)
+
+if __name__ == "__main__":
+    main()
+    print_and_log(f"Run report written to {write_report()}")
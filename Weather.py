@@ -1,142 +1,180 @@
 import os
-import logging
 import pandas as pd
-from datetime import datetime
-from google.cloud import bigquery
-from google.oauth2.service_account import Credentials
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from meteostat import Point, Hourly
 import pytz
+import archive
+from bq_loader import WRITE_MODE, merge_dataframe, write_dataframe
+from instrumentation import span, write_report
+from logging_utils import print_and_log
 
 # Coordinates for Brighton, UK
 LAT = 50.8225
 LON = -0.1372
 
+# Sites to fetch weather for, name -> (lat, lon)
+# More sites can be set as WEATHER_LOCATIONS="brighton=50.8225,-0.1372;hove=50.8279,-0.1688"
+def parse_locations(value):
+    locations = {}
+    for entry in filter(None, (part.strip() for part in value.split(';'))):
+        name, _, coordinates = entry.partition('=')
+        lat, lon = (float(number) for number in coordinates.split(','))
+        locations[name.strip()] = (lat, lon)
+    return locations
+
+DEFAULT_LOCATION = 'brighton'
+LOCATIONS = parse_locations(os.getenv('WEATHER_LOCATIONS', f"{DEFAULT_LOCATION}={LAT},{LON}"))
+
+# Output column -> Meteostat column. A new variable also needs a column in the weather schema
+# in table_schemas.py, ensure_table adds it to the BigQuery table on the next run
+VARIABLES = {
+    'temperature': 'temp',
+    'rain': 'prcp',
+    'wind_speed': 'wspd',
+}
+
+# Value used when Meteostat has no data at all for a column
+MISSING_VALUES = {'prcp': 0}
+
+# Locations fetched at once, each one walks its months serially
+MAX_WORKERS = int(os.getenv('WEATHER_MAX_WORKERS', '4'))
+
 # Timezone for British Standard Time
 BST = pytz.timezone('Europe/London')
 
-# Set up logging
-log_file = 'script_output.log'
-logging.basicConfig(filename=log_file, level=logging.DEBUG, format='%(message)s')
+# Monthly Parquet cache of raw Meteostat responses
+CACHE_DIR = os.getenv('WEATHER_CACHE_DIR', os.path.join('cache', 'weather'))
+
+def month_start(moment):
+    return datetime(moment.year, moment.month, 1)
+
+def next_month(moment):
+    return month_start(month_start(moment) + timedelta(days=32))
+
+def cache_path(lat, lon, month):
+    """Cache file for one (point, month)."""
+    return os.path.join(CACHE_DIR, f"{lat:.4f}_{lon:.4f}", f"{month.strftime('%Y-%m')}.parquet")
 
-def print_and_log(message):
-    print(message)
-    logging.debug(message)
+def is_closed_month(month, now=None):
+    """Months before the previous one are final, the current and previous month may still be revised."""
+    previous_month = month_start(month_start(now or datetime.now()) - timedelta(days=1))
+    return month < previous_month
 
 def fetch_weather_data(lat, lon, start_date, end_date):
-    """Fetch historical weather data for a specific date and location."""
-    location = Point(lat, lon)
-    weather_data = Hourly(location, start=start_date, end=end_date)
-    weather_data = weather_data.fetch()
-    return weather_data
+    """Fetch historical weather data for a specific date and location.
 
-def filter_weather_data(data, start_hour=9, end_hour=19, weekdays=None):
-    """Filter the weather data between specific hours and weekdays."""
-    filtered_data = []
+    Closed months are read from the local cache and never fetched again; the current and
+    previous month are always refreshed. Returns the data and the months fetched from Meteostat.
+    """
+    location = Point(lat, lon)
+    frames = []
+    fetched_months = []
+
+    month = month_start(start_date)
+    while month <= end_date:
+        path = cache_path(lat, lon, month)
+        if is_closed_month(month) and os.path.exists(path):
+            frames.append(pd.read_parquet(path))
+        else:
+            weather_data = Hourly(location, start=month, end=next_month(month) - timedelta(hours=1))
+            weather_data = weather_data.fetch()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            weather_data.to_parquet(path)
+            frames.append(weather_data)
+            fetched_months.append(month)
+        month = next_month(month)
+
+    print_and_log(f"Weather months fetched: {len(fetched_months)}, read from cache: {len(frames) - len(fetched_months)}")
+    weather_data = pd.concat(frames)
+    weather_data = weather_data[(weather_data.index >= start_date) & (weather_data.index <= end_date)]
+    return weather_data, fetched_months
+
+def filter_weather_data(data, start_hour=9, end_hour=19, weekdays=None, variables=None):
+    """Filter the weather data between specific hours and weekdays, keeping the requested variables."""
     if weekdays is None:
         weekdays = {0, 1, 2, 3, 4, 5, 6}  # Default to all days
-
-    for index, row in data.iterrows():
-        local_time = index.tz_localize('UTC').tz_convert(BST)  # Convert to BST
-        if start_hour <= local_time.hour < end_hour and local_time.weekday() in weekdays:
-            filtered_data.append({
-                "date": local_time.strftime("%Y-%m-%d"),
-                "time": local_time.strftime("%H:%M:%S"),
-                "temperature": row.get("temp", "N/A"),
-                "rain": row.get("prcp", 0),
-                "wind_speed": row.get("wspd", "N/A")
-            })
-    
-    return filtered_data
-
-def get_weather_data(start_date, end_date):
-    """Get weather data between specific hours and days."""
-    weather_data = fetch_weather_data(LAT, LON, start_date, end_date)
-    weekdays = {0, 2, 3, 4, 5, 6}
-    filtered_data = filter_weather_data(weather_data, weekdays=weekdays)
-    return filtered_data
-
-def save_to_csv(data, file_path):
-    """Save the data to a CSV file."""
-    # Ensure the directory exists
-    os.makedirs(os.path.dirname(file_path), exist_ok=True)
-    df = pd.DataFrame(data)
-    df.to_csv(file_path, index=False)
-    print_and_log(f"Data saved to: {file_path}")
-
-def upload_csv_to_bigquery(csv_path):
-    """Upload CSV file to Google BigQuery."""
-    credentials_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
-    if not os.path.exists(credentials_path):
-        print_and_log(f"Credentials file {credentials_path} not found.")
-        exit(1)
-
-    credentials = Credentials.from_service_account_file(credentials_path)
-    client = bigquery.Client(credentials=credentials, project='sumup-integration')
-
-    dataset_id = 'Weather'  # Your dataset ID
-    table_id = 'WeatherTable'  # Only the table name
-    table_ref = client.dataset(dataset_id).table(table_id)
-
-    job_config = bigquery.LoadJobConfig(
-        schema=[
-            bigquery.SchemaField("date", "DATE"),
-            bigquery.SchemaField("time", "TIME"),
-            bigquery.SchemaField("temperature", "FLOAT64"),
-            bigquery.SchemaField("rain", "FLOAT64"),
-            bigquery.SchemaField("wind_speed", "FLOAT64"),
-        ],
-        skip_leading_rows=1,
-        source_format=bigquery.SourceFormat.CSV,
-        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE
-    )
-
-    try:
-        with open(csv_path, "rb") as source_file:
-            job = client.load_table_from_file(source_file, table_ref, job_config=job_config)
-        
-        job.result()
-        log_bigquery_job_details(job)
-        
-    except Exception as e:
-        print_and_log(f"Failed to upload data to BigQuery: {e}")
-        raise
-
-def log_bigquery_job_details(job):
-    """Log details of the BigQuery job."""
-    job_details = job.to_api_repr()
-    print_and_log(f"Raw job details: {job_details}")
-    print_and_log(f"Data loaded into BigQuery table '{job_details.get('destinationTable', {}).get('tableId', 'Unknown Table')}'.")
-    print_and_log(f"Load job status: {job_details.get('status', {}).get('state', 'UNKNOWN')}")
-    if 'errorResult' in job_details:
-        print_and_log(f"Job failed with errors: {job_details['errorResult']}")
-    if 'statistics' in job_details:
-        statistics = job_details['statistics']
-        print_and_log(f"Total rows: {statistics.get('totalRows', 'UNKNOWN')}")
-        print_and_log(f"Total bytes processed: {statistics.get('totalBytesProcessed', 'UNKNOWN')}")
-        print_and_log(f"Total bytes billed: {statistics.get('totalBytesBilled', 'UNKNOWN')}")
-    if 'configuration' in job_details and 'load' in job_details['configuration']:
-        load_config = job_details['configuration']['load']
-        print_and_log(f"Source URIs: {load_config.get('sourceUris', 'UNKNOWN')}")
-
-def main():
+    if variables is None:
+        variables = VARIABLES
+
+    # Convert the whole index to BST at once and select rows with boolean masks
+    # The wall-clock times are kept tz-naive, which makes strftime much cheaper
+    local_time = data.index.tz_localize('UTC').tz_convert(BST).tz_localize(None)
+    mask = (local_time.hour >= start_hour) & (local_time.hour < end_hour) & local_time.weekday.isin(list(weekdays))
+    local_time = local_time[mask]
+    rows = data[mask]
+
+    def column(name):
+        return rows[name].to_numpy() if name in rows.columns else MISSING_VALUES.get(name, "N/A")
+
+    return pd.DataFrame({
+        "date": local_time.strftime("%Y-%m-%d"),
+        "time": local_time.strftime("%H:%M:%S"),
+        **{output: column(source) for output, source in variables.items()},
+    })
+
+def get_location_weather(name, lat, lon, start_date, end_date, variables):
+    """Fetch and filter one location, returning its rows tagged with the location and its refreshed months."""
+    with span('weather.fetch') as stage:
+        weather_data, fetched_months = fetch_weather_data(lat, lon, start_date, end_date)
+        stage.add(rows=len(weather_data), api_calls=len(fetched_months))
+    with span('weather.transform') as stage:
+        weekdays = {0, 2, 3, 4, 5, 6}
+        filtered_data = filter_weather_data(weather_data, weekdays=weekdays, variables=variables)
+        filtered_data.insert(0, 'location', name)
+        stage.add(rows=len(filtered_data), bytes=filtered_data.memory_usage(deep=True).sum())
+    return filtered_data, fetched_months
+
+def get_weather_data(start_date, end_date, locations=None, variables=None):
+    """Get weather data between specific hours and days for every location, in long format keyed by location.
+
+    Locations are fetched in parallel on a bounded pool and share the monthly cache. Also returns the
+    earliest month refreshed from Meteostat for any location.
+    """
+    locations = locations or LOCATIONS
+    variables = variables or VARIABLES
+    with ThreadPoolExecutor(max_workers=max(1, min(MAX_WORKERS, len(locations))), thread_name_prefix='weather') as pool:
+        futures = [
+            pool.submit(get_location_weather, name, lat, lon, start_date, end_date, variables)
+            for name, (lat, lon) in locations.items()
+        ]
+        results = [future.result() for future in futures]
+
+    weather_data = pd.concat([frame for frame, _ in results], ignore_index=True)
+    fetched_months = [month for _, months in results for month in months]
+    return weather_data, min(fetched_months, default=None)
+
+# since re-loads the weather from that date instead of only the refreshed months
+# Returns the earliest date that was loaded, or None when nothing was
+def main(since=None):
     start_date = datetime(2023, 12, 3, 0, 0, 0)
     end_date = datetime.now()
     
-    print(f"Fetching data for: {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}")
-
-    weather_data = get_weather_data(start_date, end_date)
-    
-    # Use environment variable or default to 'data'
-    save_directory = os.getenv('CSV_SAVE_DIRECTORY', 'data')
-
-    # Define the CSV filename
-    csv_filename = f"weather_data_{datetime.now().strftime('%Y%m%d')}.csv"
-    full_path = os.path.join(save_directory, csv_filename)
-
-    save_to_csv(weather_data, full_path)
-
-    if full_path:
-        upload_csv_to_bigquery(full_path)
+    print(f"Fetching data for {', '.join(LOCATIONS)}: {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}")
+
+    weather_df, refreshed_from = get_weather_data(start_date, end_date)
+
+    # Only months refreshed from Meteostat can have changed, so only those are merged
+    if since is not None:
+        weather_df = weather_df[weather_df['date'] >= since.strftime('%Y-%m-%d')]
+    elif WRITE_MODE == 'merge' and refreshed_from is not None:
+        weather_df = weather_df[weather_df['date'] >= refreshed_from.strftime('%Y-%m-%d')]
+
+    if weather_df.empty:
+        print_and_log("No weather rows to upload.")
+        return None
+
+    # Upsert the DataFrame directly, and keep the same rows in the local archive
+    # A re-sync holds only the rows from since, so it is merged whatever the write mode
+    if since is not None:
+        merge_dataframe(weather_df, 'weather')
+    else:
+        write_dataframe(weather_df, 'weather')
+    with span('weather.archive') as stage:
+        stage.add(rows=len(weather_df))
+        archive.append('weather', weather_df)
+    return datetime.strptime(weather_df['date'].min(), '%Y-%m-%d').date()
 
 if __name__ == "__main__":
     main()
+    print_and_log(f"Run report written to {write_report()}")
@@ -0,0 +1,122 @@
+"""Materialise the hourly and daily sales x bookings x weather fact tables.
+
+    python analytics.py --since 2024-06-01
+"""
+import argparse
+import os
+from datetime import date, datetime, timedelta
+
+from bq_loader import PROJECT_ID, get_client
+from instrumentation import span, write_report
+from table_schemas import TABLES
+from logging_utils import print_and_log
+
+DATASET = 'Analytics'
+HOURLY_TABLE = f"`{PROJECT_ID}.{DATASET}.HourlyFacts`"
+DAILY_TABLE = f"`{PROJECT_ID}.{DATASET}.DailyFacts`"
+
+# Days re-built when no pipeline reports an earlier affected date
+DEFAULT_LOOKBACK_DAYS = 3
+
+# The weather table holds every site in WEATHER_LOCATIONS, the facts use the shop's own
+WEATHER_LOCATION = os.getenv('ANALYTICS_WEATHER_LOCATION', 'brighton')
+
+
+def _source(table_name):
+    spec = TABLES[table_name]
+    return f"`{PROJECT_ID}.{spec['dataset']}.{spec['table']}`"
+
+
+def build_refresh_sql(start_date):
+    """Script that rebuilds every fact partition from start_date onwards in one transaction."""
+    start = f"DATE '{start_date.isoformat()}'"
+    return f"""
+CREATE SCHEMA IF NOT EXISTS `{PROJECT_ID}.{DATASET}`;
+
+CREATE TABLE IF NOT EXISTS {HOURLY_TABLE} (
+  date DATE, hour INT64,
+  revenue FLOAT64, transactions INT64,
+  bookings INT64, adults INT64, children INT64, under_4 INT64, covers INT64,
+  temperature FLOAT64, rain FLOAT64, wind_speed FLOAT64
+) PARTITION BY date;
+
+CREATE TABLE IF NOT EXISTS {DAILY_TABLE} (
+  date DATE, day_of_week STRING,
+  revenue FLOAT64, transactions INT64, average_ticket FLOAT64,
+  bookings INT64, adults INT64, children INT64, under_4 INT64, covers INT64,
+  avg_temperature FLOAT64, max_temperature FLOAT64, total_rain FLOAT64, max_wind_speed FLOAT64
+) PARTITION BY date;
+
+BEGIN TRANSACTION;
+
+DELETE FROM {HOURLY_TABLE} WHERE date >= {start};
+
+INSERT INTO {HOURLY_TABLE}
+WITH sales AS (
+  SELECT date, EXTRACT(HOUR FROM time) AS hour, SUM(amount) AS revenue, COUNT(*) AS transactions
+  FROM {_source('sales')}
+  WHERE date >= {start}
+  GROUP BY date, hour
+),
+bookings AS (
+  SELECT Date AS date, EXTRACT(HOUR FROM Time) AS hour, COUNT(*) AS bookings,
+         SUM(Adult) AS adults, SUM(Child) AS children, SUM(Under_4) AS under_4
+  FROM {_source('bookings')}
+  WHERE Date >= {start}
+  GROUP BY date, hour
+),
+weather AS (
+  SELECT date, EXTRACT(HOUR FROM time) AS hour,
+         AVG(temperature) AS temperature, SUM(rain) AS rain, AVG(wind_speed) AS wind_speed
+  FROM {_source('weather')}
+  WHERE date >= {start} AND location = '{WEATHER_LOCATION}'
+  GROUP BY date, hour
+)
+SELECT
+  date, hour,
+  IFNULL(revenue, 0), IFNULL(transactions, 0),
+  IFNULL(bookings, 0), IFNULL(adults, 0), IFNULL(children, 0), IFNULL(under_4, 0),
+  IFNULL(adults, 0) + IFNULL(children, 0) + IFNULL(under_4, 0),
+  temperature, rain, wind_speed
+FROM sales
+FULL OUTER JOIN bookings USING (date, hour)
+FULL OUTER JOIN weather USING (date, hour);
+
+DELETE FROM {DAILY_TABLE} WHERE date >= {start};
+
+INSERT INTO {DAILY_TABLE}
+SELECT
+  date, FORMAT_DATE('%A', date),
+  SUM(revenue), SUM(transactions), SAFE_DIVIDE(SUM(revenue), SUM(transactions)),
+  SUM(bookings), SUM(adults), SUM(children), SUM(under_4), SUM(covers),
+  AVG(temperature), MAX(temperature), SUM(rain), MAX(wind_speed)
+FROM {HOURLY_TABLE}
+WHERE date >= {start}
+GROUP BY date;
+
+COMMIT TRANSACTION;
+"""
+
+
+def refresh_facts(since=None):
+    """Rebuild the fact partitions from `since` (a date) onwards, defaulting to the last few days."""
+    start_date = since or (date.today() - timedelta(days=DEFAULT_LOOKBACK_DAYS))
+    with span('analytics.refresh') as stage:
+        job = get_client().query(build_refresh_sql(start_date))
+        job.result()
+        stage.add(bytes=job.total_bytes_billed, api_calls=1)
+    print_and_log(f"Analytics facts rebuilt from {start_date.isoformat()}: {job.total_bytes_billed} bytes billed.")
+    return job
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--since', type=lambda value: datetime.strptime(value, '%Y-%m-%d').date(), default=None,
+                        help=f"first date to rebuild (default: the last {DEFAULT_LOOKBACK_DAYS} days)")
+    args = parser.parse_args(argv)
+    refresh_facts(args.since)
+    print_and_log(f"Run report written to {write_report()}")
+
+
+if __name__ == '__main__':
+    main()
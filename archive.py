@@ -0,0 +1,150 @@
+"""Local columnar archive of every pipeline's rows, one compressed Parquet file per month.
+
+    archive/<table>/month=YYYY-MM/data.parquet
+
+Each load upserts its rows into the months it touches, so the archive holds one copy of the
+history however many times the pipelines run, and queries only open the months they need.
+"""
+import os
+from datetime import date
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from logging_utils import print_and_log
+from table_schemas import TABLES, coerce_to_schema, combine_duplicate_keys, get_arrow_schema
+
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+
+
+def partition_path(table_name, month):
+    return os.path.join(ARCHIVE_DIR, table_name, f"month={month}", 'data.parquet')
+
+
+def list_months(table_name):
+    """Months present in the archive for a table, oldest first, as 'YYYY-MM' strings."""
+    table_dir = os.path.join(ARCHIVE_DIR, table_name)
+    if not os.path.isdir(table_dir):
+        return []
+    return sorted(
+        name.split('=', 1)[1] for name in os.listdir(table_dir)
+        if name.startswith('month=') and os.path.exists(os.path.join(table_dir, name, 'data.parquet'))
+    )
+
+
+def _write_partition(table_name, month, df):
+    path = partition_path(table_name, month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    table = pa.Table.from_pandas(df, schema=get_arrow_schema(table_name), preserve_index=False)
+    pq.write_table(table, tmp_path, compression='zstd')
+    os.replace(tmp_path, path)
+
+
+def append(table_name, df, replace=False):
+    """Upsert rows into their month partitions on the table keys, rewriting only the months touched.
+
+    With replace=True the touched months are replaced by the given rows instead of merged.
+    Returns the months written.
+    """
+    spec = TABLES[table_name]
+    if df.empty:
+        return []
+    # Rows of one batch that share a key are combined, rows already stored are replaced by them
+    df = combine_duplicate_keys(coerce_to_schema(df, table_name), table_name)
+    months = pd.to_datetime(df[spec['partition_field']]).dt.strftime('%Y-%m')
+
+    written = []
+    for month, rows in df.groupby(months, sort=True):
+        path = partition_path(table_name, month)
+        if not replace and os.path.exists(path):
+            existing = coerce_to_schema(pq.read_table(path).to_pandas(), table_name)
+            rows = pd.concat([existing, rows], ignore_index=True)
+        rows = rows.drop_duplicates(subset=spec['keys'], keep='last').sort_values(spec['order_by'])
+        _write_partition(table_name, month, rows)
+        written.append(month)
+    return written
+
+
+def delete(table_name, key_values, start=None):
+    """Remove rows by the table's single natural key from the months from start onwards.
+
+    Only the months that held one of the keys are rewritten. Returns the number of rows removed.
+    """
+    (key,) = TABLES[table_name]['keys']
+    key_values = set(key_values)
+    first = start.strftime('%Y-%m') if start else None
+
+    removed = 0
+    for month in list_months(table_name):
+        if first is not None and month < first:
+            continue
+        rows = pq.read_table(partition_path(table_name, month)).to_pandas()
+        dropped = rows[key].map(lambda value: value in key_values).astype(bool)
+        if not dropped.any():
+            continue
+        _write_partition(table_name, month, coerce_to_schema(rows[~dropped], table_name))
+        removed += int(dropped.sum())
+    return removed
+
+
+def read(table_name, columns=None, start=None, end=None):
+    """Read a date range (inclusive `date`s, either bound optional), opening only the months it covers."""
+    partition_field = TABLES[table_name]['partition_field']
+    first = start.strftime('%Y-%m') if start else None
+    last = end.strftime('%Y-%m') if end else None
+    months = [m for m in list_months(table_name) if (first is None or m >= first) and (last is None or m <= last)]
+
+    read_columns = None
+    if columns is not None:
+        read_columns = list(dict.fromkeys(list(columns) + [partition_field]))
+    frames = [pq.read_table(partition_path(table_name, m), columns=read_columns).to_pandas() for m in months]
+    if not frames:
+        return pd.DataFrame(columns=columns or [name for name, _ in TABLES[table_name]['schema']])
+
+    df = pd.concat(frames, ignore_index=True)
+    if start is not None:
+        df = df[df[partition_field] >= start]
+    if end is not None:
+        df = df[df[partition_field] <= end]
+    return df[columns].reset_index(drop=True) if columns is not None else df.reset_index(drop=True)
+
+
+def tail(table_name, n=10, columns=None):
+    """The most recent n rows, reading months newest first until enough rows are found."""
+    frames = []
+    rows = 0
+    for month in reversed(list_months(table_name)):
+        frame = pq.read_table(partition_path(table_name, month), columns=columns).to_pandas()
+        frames.insert(0, frame)
+        rows += len(frame)
+        if rows >= n:
+            break
+    if not frames:
+        return pd.DataFrame(columns=columns or [name for name, _ in TABLES[table_name]['schema']])
+    return pd.concat(frames, ignore_index=True).tail(n).reset_index(drop=True)
+
+
+def print_tail(table_name, n=10, columns=None):
+    """Print the most recent rows of a table, in place of re-reading a whole CSV snapshot."""
+    df = tail(table_name, n, columns)
+    print_and_log(f"\nMost recent {n} rows in the {table_name} archive:")
+    print_and_log(df.to_string(index=False))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Query the local archive.')
+    parser.add_argument('table', choices=list(TABLES))
+    parser.add_argument('--start', type=date.fromisoformat)
+    parser.add_argument('--end', type=date.fromisoformat)
+    parser.add_argument('--columns', type=lambda value: value.split(','))
+    parser.add_argument('--tail', type=int, help='show only the last N rows')
+    args = parser.parse_args()
+    if args.tail:
+        result = tail(args.table, args.tail, args.columns)
+    else:
+        result = read(args.table, args.columns, args.start, args.end)
+    print(result.to_string(index=False))
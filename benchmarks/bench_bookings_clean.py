@@ -0,0 +1,58 @@
+"""Benchmark Bookings.clean_bookings against the previous per-cell cleaning on a synthetic sheet.
+
+    python -m benchmarks.bench_bookings_clean --rows 100000
+"""
+import argparse
+import time
+
+import pandas as pd
+
+from Bookings import clean_bookings
+from benchmarks.generators import synthetic_sheet
+
+
+def legacy_clean_bookings(df):
+    """The cleaning steps as they were, with a per-cell lambda for whitespace removal."""
+    df = df.copy()
+    df['Date'] = pd.to_datetime(df['Date'], format='%d.%m.%y', dayfirst=True, errors='coerce')
+    df['Time'] = pd.to_datetime(df['Time'], format='%H:%M', errors='coerce').dt.time
+    df['Adult'] = pd.to_numeric(df['Adult'], errors='coerce').fillna(0).astype(int)
+    df['Child'] = pd.to_numeric(df['Child'], errors='coerce').fillna(0).astype(int)
+    df['Under 4'] = pd.to_numeric(df['Under 4'], errors='coerce').fillna(0).astype(int)
+    df.rename(columns={'Under 4': 'Under_4'}, inplace=True)
+    df = df[df['Date'].notna() & df['Time'].notna() & (df['Adult'] >= 1)]
+    df['Contact'] = df['Contact'].str.strip().str.lower().replace({
+        'email': 'Email', 'insta': 'Insta', 'call': 'Call', 'walk in': 'Walk In',
+        'whatsapp': 'WhatsApp', 'in person': 'In Person', 'phone': 'Phone'
+    })
+    df = df[df['Contact'] != ""]
+    df.drop_duplicates(inplace=True)
+    df = df[['Date', 'Time', 'Adult', 'Child', 'Under_4', 'Name', 'Contact']]
+    return df.apply(lambda series: series.apply(lambda x: ''.join(x.split()) if isinstance(x, str) else x))
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    sheet = synthetic_sheet(args.rows)
+    legacy_seconds, legacy = timed(legacy_clean_bookings, sheet)
+    vectorized_seconds, vectorized = timed(clean_bookings, sheet)
+
+    assert legacy.to_csv(index=False) == vectorized.to_csv(index=False), "cleaned bookings changed"
+
+    print(f"rows: {args.rows}, kept: {len(vectorized)}")
+    print(f"per-cell:   {legacy_seconds * 1000:.0f} ms")
+    print(f"vectorized: {vectorized_seconds * 1000:.0f} ms")
+    print(f"speedup:    {legacy_seconds / vectorized_seconds:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""End-to-end and per-stage benchmark of each pipeline against local fakes, compared with a stored baseline.
+
+    python -m benchmarks.bench_pipelines --sizes 10k,1m
+    python -m benchmarks.bench_pipelines --pipelines sales --sizes 10k --save-baseline
+
+Every (pipeline, size) runs in a fresh process inside a temporary directory, so the peak RSS it
+reports is its own and no state, cache or archive is shared between runs. SumUp is served by
+benchmarks.mock_sumup, the sheet, Meteostat and BigQuery by benchmarks.fakes.
+
+Only the BASELINE_SIZES are stored in benchmarks/baseline.json and checked for regressions, a
+baselined size with no stored entry fails the run. 10m needs several GB of memory per pipeline,
+so it is reported for comparison by hand but never stored.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from functools import partial
+from unittest import mock
+
+from benchmarks.generators import SIZES, parse_size, per_day, sheet_values
+
+PIPELINES = ['sales', 'bookings', 'weather']
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_FILE = os.path.join(REPO_DIR, 'benchmarks', 'baseline.json')
+BASELINE_SIZES = ['10k', '1m']
+
+
+def run_sales(rows, args):
+    import TotalSales2BigQuery
+    from benchmarks.mock_sumup import mock_server_process
+    from sumup_client import SumUpClient
+
+    transactions_per_day = per_day(rows, TotalSales2BigQuery.SYNC_START_DATE, datetime.now(timezone.utc))
+    os.environ['SUMUP_API_KEY'] = 'bench'
+    with mock_server_process(transactions_per_day, args.page_size, args.latency) as base_url:
+        with mock.patch.object(TotalSales2BigQuery, 'SumUpClient', partial(SumUpClient, base_url=base_url)):
+            TotalSales2BigQuery.main()
+
+
+def run_bookings(rows, args):
+    import Bookings
+    from benchmarks.fakes import FakeSpreadsheet
+
+    spreadsheet = FakeSpreadsheet(sheet_values(rows))
+    with mock.patch.object(Bookings, 'open_bookings_spreadsheet', lambda: spreadsheet):
+        Bookings.main()
+
+
+def run_weather(rows, args):
+    import Weather
+    from benchmarks.fakes import FakeHourly
+
+    # Spread the requested rows over the pipeline's fixed date range
+    seconds = (datetime.now() - datetime(2023, 12, 3)).total_seconds()
+    FakeHourly.freq = f"{max(1, int(seconds // rows))}s"
+    with mock.patch.object(Weather, 'Hourly', FakeHourly):
+        Weather.main()
+
+
+RUNNERS = {'sales': run_sales, 'bookings': run_bookings, 'weather': run_weather}
+
+
+def worker(pipeline, rows, args):
+    """Run one pipeline in this process against the fakes and write its measurements to args.output."""
+    import bq_loader
+    import instrumentation
+    from benchmarks.fakes import RecordingBigQueryClient
+
+    client = RecordingBigQueryClient()
+    with mock.patch.object(bq_loader, 'get_client', lambda: client):
+        started = time.perf_counter()
+        RUNNERS[pipeline](rows, args)
+        seconds = time.perf_counter() - started
+
+    stages = {}
+    api_calls = 0
+    for recorded in instrumentation.spans():
+        api_calls += recorded['api_calls']
+        stages[recorded['name']] = round(stages.get(recorded['name'], 0) + recorded['seconds'], 4)
+        for stage, stage_seconds in recorded.get('stages', {}).items():
+            stages[f"{recorded['name']}.{stage}"] = stage_seconds
+
+    result = {
+        'rows': rows,
+        'seconds': round(seconds, 4),
+        'rows_per_second': round(rows / seconds, 1),
+        'peak_rss_mb': instrumentation.peak_rss_mb(),
+        'api_calls': api_calls,
+        'stages': stages,
+        **client.summary(),
+    }
+    with open(args.output, 'w') as output_file:
+        json.dump(result, output_file, indent=2)
+
+
+def run_isolated(pipeline, size, args):
+    """Run the worker for one (pipeline, size) in a fresh process and temporary directory."""
+    with tempfile.TemporaryDirectory(prefix=f"bench_{pipeline}_") as work_dir:
+        output = os.path.join(work_dir, 'result.json')
+        command = [
+            sys.executable, '-m', 'benchmarks.bench_pipelines', '--worker', pipeline, '--sizes', size,
+            '--output', output, '--page-size', str(args.page_size), '--latency', str(args.latency),
+        ]
+        env = {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [REPO_DIR, os.getenv('PYTHONPATH')]))}
+        completed = subprocess.run(command, cwd=work_dir, env=env, capture_output=not args.verbose, text=True)
+        if completed.returncode != 0:
+            raise SystemExit(f"{pipeline} {size} failed:\n{completed.stderr or ''}")
+        with open(output) as result_file:
+            return json.load(result_file)
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as baseline_file:
+        return json.load(baseline_file)
+
+
+def compare(results, baseline, tolerance):
+    """Print throughput and memory against the baseline and return the regressions beyond tolerance.
+
+    A baselined size with no stored entry counts as a regression, so a gap in the baseline is not silently skipped.
+    """
+    regressions = []
+    print(f"{'pipeline':<10}{'size':>6}{'rows/s':>14}{'vs base':>9}{'peak MB':>10}{'vs base':>9}")
+    for key, result in results.items():
+        pipeline, size = key.split(':')
+        base = baseline.get(key)
+        throughput_ratio = rss_ratio = None
+        if not base and size in BASELINE_SIZES:
+            regressions.append(f"{key} has no baseline, record it with --save-baseline")
+        elif base:
+            throughput_ratio = result['rows_per_second'] / base['rows_per_second']
+            rss_ratio = result['peak_rss_mb'] / base['peak_rss_mb']
+            if throughput_ratio < 1 - tolerance:
+                regressions.append(f"{key} throughput {throughput_ratio:.2f}x of baseline")
+            if rss_ratio > 1 + tolerance:
+                regressions.append(f"{key} peak RSS {rss_ratio:.2f}x of baseline")
+        print(
+            f"{pipeline:<10}{size:>6}{result['rows_per_second']:>14,.0f}"
+            f"{f'{throughput_ratio:.2f}x' if throughput_ratio else '-':>9}"
+            f"{result['peak_rss_mb']:>10,.1f}{f'{rss_ratio:.2f}x' if rss_ratio else '-':>9}"
+        )
+        for stage, seconds in sorted(result['stages'].items()):
+            print(f"    {stage:<32}{seconds:>10.3f}s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pipelines', default=','.join(PIPELINES), help=f"comma-separated, from {PIPELINES}")
+    parser.add_argument('--sizes', default='10k', help=f"comma-separated, from {list(SIZES)} or row counts")
+    parser.add_argument('--page-size', type=int, default=1000, help='mock SumUp page size')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every mock SumUp response')
+    parser.add_argument('--baseline', default=BASELINE_FILE)
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown or memory growth')
+    parser.add_argument('--verbose', action='store_true', help='show the pipelines output')
+    parser.add_argument('--worker', choices=PIPELINES, help=argparse.SUPPRESS)
+    parser.add_argument('--output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return worker(args.worker, parse_size(args.sizes), args)
+
+    results = {}
+    for size in args.sizes.split(','):
+        for pipeline in args.pipelines.split(','):
+            results[f"{pipeline}:{size}"] = run_isolated(pipeline, size, args)
+
+    baseline = load_baseline(args.baseline)
+    regressions = compare(results, baseline, args.tolerance)
+    if args.save_baseline:
+        saved = {key: result for key, result in results.items() if key.split(':')[1] in BASELINE_SIZES}
+        skipped = sorted(set(results) - set(saved))
+        if skipped:
+            print(f"Not saving {skipped}, only sizes {BASELINE_SIZES} are baselined")
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump({**baseline, **saved}, baseline_file, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+    elif regressions:
+        raise SystemExit("Regressions against the baseline:\n  " + "\n  ".join(regressions))
+
+
+if __name__ == '__main__':
+    main()
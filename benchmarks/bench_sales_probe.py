@@ -0,0 +1,64 @@
+"""Time a scheduled sales run that finds nothing new, end to end in a fresh interpreter.
+
+    python -m benchmarks.bench_sales_probe --runs 5 --max-seconds 1
+
+The watermark is advanced past the mock's newest transaction as a real run would, so each run
+should stop after the probe. The newest transaction is a failed one, which is never uploaded.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.mock_sumup import MockSumUpServer, generate_transaction, mock_server_process
+from TotalSales2BigQuery import advance_watermark, parse_timestamp
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The mock fails every 20th transaction of a day, so with 41 a day the newest one is failed
+PER_DAY = 41
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every mock SumUp response')
+    parser.add_argument('--max-seconds', type=float, default=0, help='fail if the median run is slower than this')
+    args = parser.parse_args()
+
+    latest = MockSumUpServer(per_day=PER_DAY).latest()
+    if latest['status'] == 'SUCCESSFUL':
+        raise SystemExit("the newest mock transaction should be one that is never uploaded")
+    # The last run uploaded the successful transaction before the newest, and saw the failed newest one
+    loaded = generate_transaction(datetime.now(), PER_DAY - 2, PER_DAY)
+    watermark = advance_watermark(None, (parse_timestamp(latest['timestamp']), latest['id'], latest['status']),
+                                  {loaded['id']: parse_timestamp(loaded['timestamp'])})
+    with tempfile.TemporaryDirectory(prefix='bench_probe_') as work_dir, \
+            mock_server_process(per_day=PER_DAY, latency=args.latency) as base_url:
+        os.makedirs(os.path.join(work_dir, 'state'))
+        with open(os.path.join(work_dir, 'state', 'sales_watermark.json'), 'w') as state_file:
+            json.dump(watermark, state_file)
+
+        env = {**os.environ, 'SUMUP_API_KEY': 'bench', 'SUMUP_BASE_URL': base_url}
+        timings = []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            completed = subprocess.run([sys.executable, os.path.join(REPO_DIR, 'TotalSales2BigQuery.py')],
+                                       cwd=work_dir, env=env, capture_output=True, text=True)
+            timings.append(time.perf_counter() - started)
+            if completed.returncode != 0 or 'nothing to do' not in completed.stdout:
+                raise SystemExit(f"probe run did not stop early:\n{completed.stdout}\n{completed.stderr}")
+
+    median = statistics.median(timings)
+    print(f"runs: {args.runs}, median: {median * 1000:.0f} ms, min: {min(timings) * 1000:.0f} ms")
+    if args.max_seconds and median > args.max_seconds:
+        raise SystemExit(f"median {median:.2f}s is above the allowed {args.max_seconds}s")
+
+
+if __name__ == '__main__':
+    main()
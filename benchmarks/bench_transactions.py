@@ -0,0 +1,112 @@
+"""Compare parsing SumUp pages into typed records against the previous per-page DataFrame path.
+
+    python -m benchmarks.bench_transactions --items 100000 --page-size 100
+"""
+import argparse
+import json
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta, timezone
+
+import pandas as pd
+import pyarrow as pa
+
+from benchmarks.mock_sumup import generate_transaction
+from table_schemas import coerce_to_schema, get_arrow_schema
+from transactions import parse_page, to_arrow
+
+START = datetime(2023, 12, 3, tzinfo=timezone.utc)
+
+
+def synthetic_pages(items, page_size, per_day=200):
+    """Pages of mock items, every tenth one repeated from the previous page as shard overlaps are."""
+    raw = [generate_transaction(date(2024, 1, 1) + timedelta(days=n // per_day), n % per_day, per_day)
+           for n in range(items)]
+    pages = [raw[i:i + page_size] for i in range(0, items, page_size)]
+    return [page + previous[::10] for previous, page in zip([[]] + pages, pages)]
+
+
+def legacy_transactions_to_chunk(transactions, start_date, end_date):
+    """The per-page DataFrame parsing this replaces."""
+    df = pd.DataFrame(
+        [(t.get('id'), t.get('timestamp'), t.get('status'), t.get('amount')) for t in transactions],
+        columns=['id', 'timestamp', 'status', 'amount'],
+    )
+    df = df[df['status'] == 'SUCCESSFUL']
+    df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True, format='ISO8601')
+    df = df[(df['timestamp'] >= start_date) & (df['timestamp'] <= end_date)]
+    local_time = df['timestamp'].dt.tz_convert('Europe/London')
+    return pd.DataFrame({
+        'transaction_id': df['id'],
+        'utc_timestamp': df['timestamp'].map(lambda ts: ts.isoformat(timespec='microseconds')),
+        'date': local_time.dt.strftime('%Y-%m-%d'),
+        'time': local_time.dt.strftime('%H:%M:%S'),
+        'day_of_week': local_time.dt.strftime('%A'),
+        'amount': df['amount'],
+    })
+
+
+def legacy(pages, end_date, schema):
+    seen_ids = set()
+    tables = []
+    for transactions in pages:
+        chunk = legacy_transactions_to_chunk(transactions, START, end_date)
+        known = chunk['transaction_id'].map(lambda tx_id: tx_id in seen_ids).astype(bool)
+        chunk = chunk[~known & ~chunk['transaction_id'].duplicated()]
+        seen_ids.update(chunk['transaction_id'])
+        tables.append(pa.Table.from_pandas(coerce_to_schema(chunk, 'sales'), schema=schema, preserve_index=False))
+    return pa.concat_tables(tables)
+
+
+def typed(pages, end_date, schema):
+    seen_ids = set()
+    tables = []
+    for items in pages:
+        records, _, _ = parse_page(items, START, end_date, seen_ids)
+        tables.append(to_arrow(records, schema))
+    return pa.concat_tables(tables)
+
+
+def bytes_per_item(build, count):
+    """Memory held per item by the objects build() returns."""
+    tracemalloc.start()
+    held = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del held
+    return size / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--page-size', type=int, default=100)
+    args = parser.parse_args()
+
+    end_date = datetime.now(timezone.utc)
+    schema = get_arrow_schema('sales')
+    pages = synthetic_pages(args.items, args.page_size)
+
+    started = time.perf_counter()
+    expected = legacy(pages, end_date, schema)
+    legacy_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    result = typed(pages, end_date, schema)
+    typed_seconds = time.perf_counter() - started
+    assert result.equals(expected), "parsed transactions changed"
+
+    # Both decoded from the same JSON, so each side owns all of its strings and numbers
+    sample = json.dumps(pages[1])
+    count = len(pages[1])
+    dict_bytes = bytes_per_item(lambda: json.loads(sample), count)
+    record_bytes = bytes_per_item(lambda: parse_page(json.loads(sample), START, end_date, set())[0], count)
+
+    print(f"items: {args.items}, kept: {result.num_rows}")
+    print(f"per-page DataFrame: {legacy_seconds * 1000:.0f} ms")
+    print(f"typed records:      {typed_seconds * 1000:.0f} ms ({legacy_seconds / typed_seconds:.1f}x)")
+    print(f"memory per item:    {dict_bytes:.0f} B as a raw dict, {record_bytes:.0f} B as a record "
+          f"({dict_bytes / record_bytes:.1f}x smaller)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Micro-benchmark of Weather.filter_weather_data against the previous iterrows loop.
+
+    python -m benchmarks.bench_weather_filter --rows 25000 --min-speedup 10
+"""
+import argparse
+import time
+
+import pandas as pd
+
+from Weather import BST, filter_weather_data
+from benchmarks.generators import synthetic_hourly
+
+WEEKDAYS = {0, 2, 3, 4, 5, 6}
+
+
+def legacy_filter_weather_data(data, start_hour=9, end_hour=19, weekdays=None):
+    """The row-by-row implementation this benchmark guards against regressing to."""
+    filtered_data = []
+    if weekdays is None:
+        weekdays = {0, 1, 2, 3, 4, 5, 6}
+    for index, row in data.iterrows():
+        local_time = index.tz_localize('UTC').tz_convert(BST)
+        if start_hour <= local_time.hour < end_hour and local_time.weekday() in weekdays:
+            filtered_data.append({
+                "date": local_time.strftime("%Y-%m-%d"),
+                "time": local_time.strftime("%H:%M:%S"),
+                "temperature": row.get("temp", "N/A"),
+                "rain": row.get("prcp", 0),
+                "wind_speed": row.get("wspd", "N/A")
+            })
+    return filtered_data
+
+
+def best_of(repeat, func, *args, **kwargs):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=25000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--min-speedup', type=float, default=0, help='fail if the speedup drops below this')
+    args = parser.parse_args()
+
+    data = synthetic_hourly(args.rows)
+    legacy_seconds, legacy = best_of(1, legacy_filter_weather_data, data, weekdays=WEEKDAYS)
+    vectorized_seconds, vectorized = best_of(args.repeat, filter_weather_data, data, weekdays=WEEKDAYS)
+
+    # Both must produce the same CSV
+    assert pd.DataFrame(legacy).to_csv(index=False) == vectorized.to_csv(index=False), "output changed"
+
+    speedup = legacy_seconds / vectorized_seconds
+    print(f"rows: {args.rows}, kept: {len(vectorized)}")
+    print(f"iterrows:   {legacy_seconds * 1000:.1f} ms")
+    print(f"vectorized: {vectorized_seconds * 1000:.1f} ms")
+    print(f"speedup:    {speedup:.0f}x")
+    if speedup < args.min_speedup:
+        raise SystemExit(f"speedup {speedup:.1f}x is below the required {args.min_speedup}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Local stand-ins for gspread, Meteostat and BigQuery, so the pipelines run without credentials.
+
+The SumUp stand-in is the HTTP mock in benchmarks.mock_sumup.
+"""
+import io
+import threading
+
+import pandas as pd
+import pyarrow.parquet as pq
+from google.api_core.exceptions import NotFound
+from google.cloud import bigquery
+
+from benchmarks.generators import synthetic_hourly
+
+
+class FakeWorksheet:
+    """The subset of gspread.Worksheet the Bookings pipeline reads: col_count and batch_get."""
+
+    def __init__(self, values):
+        self.values = values
+        self.col_count = len(values[0])
+        self.calls = 0
+
+    def batch_get(self, ranges):
+        self.calls += 1
+        return [self._range(cell_range) for cell_range in ranges]
+
+    def _range(self, cell_range):
+        # Only the whole-width 'A<first>:<col><last>' and 'A<first>:<col>' ranges Bookings asks for
+        first, _, last = cell_range.partition(':')
+        first_row = int(first[1:])
+        last_digits = ''.join(ch for ch in last if ch.isdigit())
+        last_row = int(last_digits) if last_digits else len(self.values)
+        return self.values[first_row - 1:last_row]
+
+
+class FakeSpreadsheet:
+    """A spreadsheet with one 'Bookings' worksheet and a fixed modified time."""
+
+    def __init__(self, values, spreadsheet_id='bench-sheet', modified_time='2024-06-01T00:00:00.000Z'):
+        self.id = spreadsheet_id
+        self.modified_time = modified_time
+        self.sheet = FakeWorksheet(values)
+
+    def get_lastUpdateTime(self):
+        return self.modified_time
+
+    def worksheet(self, name):
+        return self.sheet
+
+
+class FakeHourly:
+    """Drop-in for meteostat.Hourly that returns a synthetic frame for the requested range.
+
+    freq sets the row density, so a fixed date range can hold any number of rows.
+    """
+
+    freq = 'h'
+    calls = 0
+
+    def __init__(self, location, start, end):
+        self.start = start
+        self.end = end
+
+    def fetch(self):
+        FakeHourly.calls += 1
+        rows = len(pd.date_range(self.start, self.end, freq=self.freq))
+        return synthetic_hourly(rows, seed=self.start.month, start=self.start, freq=self.freq)
+
+
+class FakeJob:
+    """Finished load or query job with the attributes bq_loader and analytics read."""
+
+    def __init__(self, destination=None, output_rows=0, input_file_bytes=0):
+        self.destination = destination
+        self.output_rows = output_rows
+        self.input_file_bytes = input_file_bytes
+        self.num_dml_affected_rows = 0
+        self.total_bytes_billed = 0
+        self.state = 'DONE'
+        self.error_result = None
+
+    def result(self):
+        return self
+
+
+class RecordingBigQueryClient:
+    """Records every load and query instead of sending it, serialising DataFrames as the real client does."""
+
+    project = 'bench-project'
+
+    def __init__(self):
+        self.tables = {}
+        self.loads = []
+        self.queries = []
+        self._lock = threading.Lock()
+
+    def dataset(self, dataset_id):
+        return bigquery.DatasetReference(self.project, dataset_id)
+
+    def get_table(self, table_ref):
+        if table_ref.table_id not in self.tables:
+            raise NotFound(f"Table {table_ref.table_id} not found")
+        return self.tables[table_ref.table_id]
+
+    def create_table(self, table):
+        self.tables[table.table_id] = table
+        return table
+
+    def update_table(self, table, fields):
+        self.tables[table.table_id] = table
+        return table
+
+    def delete_table(self, table_ref, not_found_ok=False):
+        pass
+
+    def _record_load(self, destination, rows, size):
+        with self._lock:
+            self.loads.append({'table': destination.table_id, 'rows': rows, 'bytes': size})
+        return FakeJob(destination, rows, size)
+
+    def load_table_from_dataframe(self, df, destination, job_config=None):
+        buffer = io.BytesIO()
+        df.to_parquet(buffer, index=False)
+        return self._record_load(destination, len(df), buffer.tell())
+
+    def load_table_from_file(self, source_file, destination, job_config=None):
+        data = source_file.read()
+        rows = pq.ParquetFile(io.BytesIO(data)).metadata.num_rows
+        return self._record_load(destination, rows, len(data))
+
+    def query(self, sql, job_config=None):
+        with self._lock:
+            self.queries.append(sql)
+        return FakeJob()
+
+    def summary(self):
+        return {
+            'loads': len(self.loads),
+            'rows_loaded': sum(load['rows'] for load in self.loads),
+            'bytes_loaded': sum(load['bytes'] for load in self.loads),
+            'queries': len(self.queries),
+        }
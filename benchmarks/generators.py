@@ -0,0 +1,76 @@
+"""Synthetic inputs for the benchmarks, shaped like what SumUp, the Bookings sheet and Meteostat return."""
+import math
+
+import numpy as np
+import pandas as pd
+
+from Bookings import EXPECTED_HEADERS
+
+# Named dataset sizes accepted by the benchmarks
+SIZES = {
+    '10k': 10_000,
+    '1m': 1_000_000,
+    '10m': 10_000_000,
+}
+
+CONTACTS = ['Email', ' email ', 'Insta', 'CALL', 'walk in', 'WhatsApp', 'In Person', 'phone', '', 'text']
+NAMES = ['John Smith', 'Jane  Doe', ' Ali ', 'Sam', 'Mary Ann Lee', '']
+
+
+def parse_size(value):
+    """'10k', '1m', '10m' or a plain row count."""
+    return SIZES[value.lower()] if value.lower() in SIZES else int(value)
+
+
+def per_day(rows, start, end):
+    """Transactions per day so that the mock SumUp history between start and end holds about `rows` items."""
+    return max(1, math.ceil(rows / ((end - start).days + 1)))
+
+
+def synthetic_sheet(rows, seed=0):
+    """Raw rows shaped like the 'Bookings' tab, including the junk the cleaning has to drop."""
+    rng = np.random.default_rng(seed)
+    dates = pd.Timestamp('2024-03-01') + pd.to_timedelta(rng.integers(0, 240, rows), unit='D')
+    date_text = dates.strftime('%d.%m.%y').to_numpy(dtype=object)
+    date_text[rng.random(rows) < 0.01] = 'tbc'
+    times = [f"{h:02d}:{m:02d}" for h, m in zip(rng.integers(9, 19, rows), rng.choice([0, 15, 30, 45], rows))]
+    return pd.DataFrame({
+        'Date': date_text,
+        'Time': times,
+        'Adult': rng.choice(['0', '1', '2', '3', '4', ''], rows).astype(object),
+        'Child': rng.choice(['0', '1', '2', ''], rows).astype(object),
+        'Under 4': rng.choice(['0', '1', ''], rows).astype(object),
+        'Name': rng.choice(NAMES, rows).astype(object),
+        'Contact': rng.choice(CONTACTS, rows).astype(object),
+    }, columns=EXPECTED_HEADERS).astype(object)
+
+
+def sheet_values(rows, seed=0):
+    """The synthetic sheet as the lists of cell strings gspread returns, header row first."""
+    sheet = synthetic_sheet(rows, seed)
+    return [list(sheet.columns)] + sheet.to_numpy().tolist()
+
+
+def synthetic_hourly(rows, seed=0, start='2023-12-03', freq='h'):
+    """Frame shaped like meteostat Hourly.fetch(): naive UTC 'time' index and station columns.
+
+    freq below an hour packs more rows into a date range than Meteostat would, for the larger sizes.
+    """
+    rng = np.random.default_rng(seed)
+    index = pd.date_range(start, periods=rows, freq=freq, name='time')
+    frame = pd.DataFrame({
+        'temp': rng.normal(12, 5, rows).round(1),
+        'dwpt': rng.normal(8, 4, rows).round(1),
+        'rhum': rng.uniform(40, 100, rows).round(0),
+        'prcp': rng.choice([0.0, 0.0, 0.0, 0.2, 1.4], rows),
+        'snow': np.nan,
+        'wdir': rng.uniform(0, 360, rows).round(0),
+        'wspd': rng.gamma(2, 8, rows).round(1),
+        'wpgt': np.nan,
+        'pres': rng.normal(1013, 8, rows).round(1),
+        'tsun': np.nan,
+        'coco': rng.integers(1, 9, rows).astype(float),
+    }, index=index)
+    # Meteostat leaves gaps as NaN
+    frame.loc[frame.sample(frac=0.01, random_state=seed).index, 'temp'] = np.nan
+    return frame
@@ -0,0 +1,122 @@
+"""Local stand-in for the SumUp transaction history endpoint."""
+import json
+import multiprocessing
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+
+def generate_transaction(day, i, per_day):
+    """Deterministic i-th transaction of one calendar day."""
+    timestamp = datetime(day.year, day.month, day.day, 9) + timedelta(seconds=i * 36000 // max(per_day, 1))
+    return {
+        'id': f"{day:%Y%m%d}-{i:05d}",
+        'transaction_code': f"T{day:%Y%m%d}{i:05d}",
+        'timestamp': timestamp.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+        'status': 'SUCCESSFUL' if i % 20 else 'FAILED',
+        'amount': round(2.5 + (i % 17) * 1.25, 2),
+        'currency': 'GBP',
+        'payment_type': 'POS',
+        'user': 'bench@example.com',
+    }
+
+
+class MockSumUpServer:
+    """Serve paginated /me/transactions/history with a fixed per-request latency."""
+
+    def __init__(self, per_day=50, page_size=100, latency=0.05):
+        self.per_day = per_day
+        self.page_size = page_size
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def page(self, start, end, page):
+        """Return one page of the [start, end] history and whether another page follows."""
+        total = ((end - start).days + 1) * self.per_day
+        first = page * self.page_size
+        items = [
+            generate_transaction(start + timedelta(days=n // self.per_day), n % self.per_day, self.per_day)
+            for n in range(first, min(first + self.page_size, total))
+        ]
+        return items, first + self.page_size < total
+
+    def latest(self):
+        return generate_transaction(datetime.now(), self.per_day - 1, self.per_day)
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with mock._lock:
+                    mock.requests += 1
+                time.sleep(mock.latency)
+
+                query = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+                links = []
+                if 'from' not in query:
+                    # order=descending&limit=1: the newest transaction, which is today's last one
+                    page_items = [mock.latest()]
+                else:
+                    start = datetime.strptime(query['from'], '%Y-%m-%d')
+                    end = datetime.strptime(query['to'], '%Y-%m-%d')
+                    page = int(query.get('page', 0))
+
+                    page_items, has_next = mock.page(start, end, page)
+                    if has_next:
+                        links.append({'rel': 'next', 'href': urlencode({'from': query['from'], 'to': query['to'], 'page': page + 1})})
+
+                body = json.dumps({'items': page_items, 'links': links}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+def _serve(per_day, page_size, latency, ports):
+    with MockSumUpServer(per_day, page_size, latency) as server:
+        ports.put(server._server.server_port)
+        threading.Event().wait()
+
+
+@contextmanager
+def mock_server_process(per_day=50, page_size=100, latency=0.05):
+    """Run the mock in a child process, so generating and encoding pages does not compete with the client for the GIL.
+
+    Yields the base URL.
+    """
+    # Spawn rather than fork, a forked copy of a threaded parent can inherit held locks
+    context = multiprocessing.get_context('spawn')
+    ports = context.Queue()
+    process = context.Process(target=_serve, args=(per_day, page_size, latency, ports), daemon=True)
+    process.start()
+    try:
+        yield f"http://127.0.0.1:{ports.get(timeout=30)}"
+    finally:
+        process.terminate()
+        process.join()
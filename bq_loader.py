@@ -0,0 +1,324 @@
+import os
+import sys
+import threading
+from functools import lru_cache
+
+from google.cloud import bigquery
+from google.api_core.exceptions import GoogleAPIError, NotFound
+from google.oauth2.service_account import Credentials
+
+from instrumentation import span
+from logging_utils import print_and_log
+from table_schemas import TABLES, coerce_to_schema, combine_duplicate_keys, min_partition_date
+
+PROJECT_ID = 'sumup-integration'
+
+# 'merge' upserts new rows on the table keys, 'truncate' rewrites the whole table
+WRITE_MODE = os.getenv('BQ_WRITE_MODE', 'merge')
+
+# Scopes for every Google API the pipelines call, so one credentials object serves them all
+SCOPES = [
+    'https://www.googleapis.com/auth/cloud-platform',
+    'https://www.googleapis.com/auth/spreadsheets',
+    'https://www.googleapis.com/auth/drive',
+]
+
+# Pipelines run on concurrent threads, only one of them should build the shared objects
+_client_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def _load_credentials():
+    credentials_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
+    if not credentials_path or not os.path.exists(credentials_path):
+        print_and_log(f"Credentials file {credentials_path} not found.")
+        sys.exit(1)
+    return Credentials.from_service_account_file(credentials_path, scopes=SCOPES)
+
+
+def get_credentials():
+    """Service account credentials from GOOGLE_APPLICATION_CREDENTIALS, read once per process."""
+    with _client_lock:
+        return _load_credentials()
+
+
+@lru_cache(maxsize=None)
+def _build_client():
+    return bigquery.Client(credentials=_load_credentials(), project=PROJECT_ID)
+
+
+def get_client():
+    """Build the BigQuery client once per process and share it between pipelines."""
+    with _client_lock:
+        return _build_client()
+
+
+def get_schema(table_name):
+    return [bigquery.SchemaField(name, field_type) for name, field_type in TABLES[table_name]['schema']]
+
+
+def get_table_ref(table_name, suffix=''):
+    spec = TABLES[table_name]
+    return get_client().dataset(spec['dataset']).table(spec['table'] + suffix)
+
+
+def get_staging_ref(table_name):
+    return get_table_ref(table_name, suffix='_staging')
+
+
+def _table_path(table_ref):
+    return f"`{table_ref.project}.{table_ref.dataset_id}.{table_ref.table_id}`"
+
+
+def _time_partitioning(table_name):
+    partition_field = TABLES[table_name]['partition_field']
+    return bigquery.TimePartitioning(field=partition_field) if partition_field else None
+
+
+def _job_config(table_name, write_disposition, partitioned=False):
+    job_config = bigquery.LoadJobConfig(
+        schema=get_schema(table_name),
+        source_format=bigquery.SourceFormat.PARQUET,
+        write_disposition=write_disposition,
+    )
+    if partitioned:
+        # A truncating load replaces the table, so it must restate the partitioning to keep it
+        job_config.time_partitioning = _time_partitioning(table_name)
+    return job_config
+
+
+def _truncates_target(write_disposition, destination):
+    """Whether a load replaces the target table itself, rather than appending or filling a staging table."""
+    return destination is None and write_disposition == bigquery.WriteDisposition.WRITE_TRUNCATE
+
+
+def load_dataframe(df, table_name, write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE, destination=None):
+    """Load a DataFrame into a table through Parquet, keeping the column types intact."""
+    partitioned = _truncates_target(write_disposition, destination)
+    if partitioned:
+        ensure_table(table_name)
+    try:
+        with span(f"{table_name}.load") as stage:
+            job = get_client().load_table_from_dataframe(
+                coerce_to_schema(df, table_name),
+                destination or get_table_ref(table_name),
+                job_config=_job_config(table_name, write_disposition, partitioned),
+            )
+            # Wait for the load job to complete
+            job.result()
+            stage.add(rows=job.output_rows, bytes=job.input_file_bytes, api_calls=1)
+        log_bigquery_job_details(job)
+        return job
+    except GoogleAPIError as e:
+        print_and_log(f"Failed to upload data to BigQuery: {e}")
+        raise
+
+
+def load_parquet_file(parquet_path, table_name, write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+                      destination=None):
+    """Load a Parquet file written with the table schema, without reading it into memory."""
+    partitioned = _truncates_target(write_disposition, destination)
+    if partitioned:
+        ensure_table(table_name)
+    try:
+        with span(f"{table_name}.load") as stage, open(parquet_path, 'rb') as source_file:
+            job = get_client().load_table_from_file(
+                source_file,
+                destination or get_table_ref(table_name),
+                job_config=_job_config(table_name, write_disposition, partitioned),
+            )
+            job.result()
+            stage.add(rows=job.output_rows, bytes=os.path.getsize(parquet_path), api_calls=1)
+        log_bigquery_job_details(job)
+        return job
+    except GoogleAPIError as e:
+        print_and_log(f"Failed to upload data to BigQuery: {e}")
+        raise
+
+
+def partition_table(table_name):
+    """Recreate an unpartitioned table partitioned by date, then swap it in under the original name.
+
+    BigQuery cannot add partitioning to an existing table, so the rows are copied into a partitioned
+    table first. The original is only dropped once the copy has succeeded.
+    """
+    spec = TABLES[table_name]
+    table_ref = get_table_ref(table_name)
+    partitioned_ref = get_table_ref(table_name, suffix='_partitioned')
+    script = (
+        f"CREATE OR REPLACE TABLE {_table_path(partitioned_ref)} PARTITION BY {spec['partition_field']}\n"
+        f"AS SELECT * FROM {_table_path(table_ref)};\n"
+        f"DROP TABLE {_table_path(table_ref)};\n"
+        f"ALTER TABLE {_table_path(partitioned_ref)} RENAME TO `{table_ref.table_id}`;"
+    )
+    try:
+        with span(f"{table_name}.partition") as stage:
+            job = get_client().query(script)
+            job.result()
+            stage.add(bytes=job.total_bytes_billed, api_calls=1)
+        print_and_log(
+            f"Recreated '{spec['table']}' partitioned by {spec['partition_field']}, "
+            f"{job.total_bytes_billed} bytes billed."
+        )
+        return job
+    except GoogleAPIError as e:
+        print_and_log(f"Failed to partition '{spec['table']}': {e}")
+        raise
+
+
+def ensure_table(table_name):
+    """Create the table partitioned by date if it is missing, or add any new schema columns to it.
+
+    A table created unpartitioned by an earlier version is migrated to date partitions once.
+    """
+    client = get_client()
+    spec = TABLES[table_name]
+    table_ref = get_table_ref(table_name)
+    try:
+        table = client.get_table(table_ref)
+    except NotFound:
+        table = bigquery.Table(table_ref, schema=get_schema(table_name))
+        table.time_partitioning = _time_partitioning(table_name)
+        client.create_table(table)
+        print_and_log(f"Created table '{spec['table']}'" + (
+            f" partitioned by {spec['partition_field']}." if spec['partition_field'] else '.'))
+        return
+
+    existing = {field.name for field in table.schema}
+    missing = [field for field in get_schema(table_name) if field.name not in existing]
+    if missing:
+        table.schema = list(table.schema) + missing
+        client.update_table(table, ['schema'])
+        print_and_log(f"Added columns {[field.name for field in missing]} to '{spec['table']}'.")
+        # Rows already in the table take the column's default, as the archive does on read
+        defaults = {field.name: spec['defaults'][field.name] for field in missing if field.name in spec.get('defaults', {})}
+        if defaults:
+            assignments = ', '.join(f"{name} = @{name}" for name in defaults)
+            job_config = bigquery.QueryJobConfig(query_parameters=[
+                bigquery.ScalarQueryParameter(name, 'STRING', value) for name, value in defaults.items()
+            ])
+            conditions = ' AND '.join(f"{name} IS NULL" for name in defaults)
+            client.query(
+                f"UPDATE {_table_path(table_ref)} SET {assignments} WHERE {conditions}", job_config=job_config
+            ).result()
+            print_and_log(f"Filled {list(defaults)} on existing rows of '{spec['table']}'.")
+
+    if table.time_partitioning is None and spec['partition_field']:
+        # Without partitions the date filters in merges and deletes cannot prune anything
+        partition_table(table_name)
+
+
+def build_merge_sql(table_name, min_date=None, delete_missing=False):
+    """MERGE the staging table into the target on the natural keys, touching only changed rows."""
+    spec = TABLES[table_name]
+    columns = [name for name, _ in spec['schema']]
+    keys = spec['keys']
+    values = [name for name in columns if name not in keys]
+
+    # NULL-safe key match, plus a constant filter on the partition column so only recent partitions are scanned
+    conditions = [f"(T.{key} = S.{key} OR (T.{key} IS NULL AND S.{key} IS NULL))" for key in keys]
+    partition_filter = ''
+    if min_date is not None:
+        partition_filter = f"T.{spec['partition_field']} >= DATE '{min_date.isoformat()}'"
+        conditions.append(partition_filter)
+
+    changed = ' OR '.join(f"T.{name} IS DISTINCT FROM S.{name}" for name in values)
+    updates = ', '.join(f"{name} = S.{name}" for name in values)
+    sql = (
+        f"MERGE {_table_path(get_table_ref(table_name))} T\n"
+        f"USING {_table_path(get_staging_ref(table_name))} S\n"
+        f"ON {' AND '.join(conditions)}\n"
+    )
+    if values:
+        sql += f"WHEN MATCHED AND ({changed}) THEN UPDATE SET {updates}\n"
+    sql += f"WHEN NOT MATCHED THEN INSERT ({', '.join(columns)}) VALUES ({', '.join('S.' + name for name in columns)})"
+    if delete_missing:
+        # The source is a full snapshot from min_date onwards, so rows it no longer has are removed
+        sql += "\nWHEN NOT MATCHED BY SOURCE" + (f" AND {partition_filter}" if partition_filter else '') + " THEN DELETE"
+    return sql
+
+
+def merge_staging(table_name, min_date=None, delete_missing=False):
+    """Run the MERGE from the loaded staging table, then drop the staging table."""
+    client = get_client()
+    try:
+        with span(f"{table_name}.merge") as stage:
+            job = client.query(build_merge_sql(table_name, min_date, delete_missing))
+            job.result()
+            stage.add(rows=job.num_dml_affected_rows, bytes=job.total_bytes_billed, api_calls=1)
+        print_and_log(
+            f"Merged into '{TABLES[table_name]['table']}': {job.num_dml_affected_rows} rows affected, "
+            f"{job.total_bytes_billed} bytes billed."
+        )
+        return job
+    except GoogleAPIError as e:
+        print_and_log(f"Failed to merge data into BigQuery: {e}")
+        raise
+    finally:
+        client.delete_table(get_staging_ref(table_name), not_found_ok=True)
+
+
+def merge_dataframe(df, table_name, delete_missing=False, min_date=None):
+    """Upsert a DataFrame into the table through a staging table, keyed on the table's natural keys.
+
+    min_date defaults to the DataFrame's earliest date. Pass it when the DataFrame is a snapshot of a
+    range whose first days, or all of it, may have no rows left, so delete_missing still covers them.
+    """
+    ensure_table(table_name)
+    # MERGE needs at most one source row per key
+    df = combine_duplicate_keys(coerce_to_schema(df, table_name), table_name)
+    load_dataframe(df, table_name, destination=get_staging_ref(table_name))
+    if min_date is None:
+        min_date = min_partition_date(df, table_name)
+    return merge_staging(table_name, min_date, delete_missing)
+
+
+def merge_parquet_file(parquet_path, table_name):
+    """Upsert a Parquet file written with the table schema through a staging table."""
+    ensure_table(table_name)
+    load_parquet_file(parquet_path, table_name, destination=get_staging_ref(table_name))
+    return merge_staging(table_name, min_partition_date(parquet_path, table_name))
+
+
+def delete_rows(table_name, key_values, min_date=None):
+    """Delete rows by the table's single natural key, scanning only the partitions from min_date when given."""
+    spec = TABLES[table_name]
+    (key,) = spec['keys']
+    conditions = [f"{key} IN UNNEST(@key_values)"]
+    if min_date is not None:
+        conditions.append(f"{spec['partition_field']} >= DATE '{min_date.isoformat()}'")
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ArrayQueryParameter('key_values', dict(spec['schema'])[key], list(key_values)),
+    ])
+    client = get_client()
+    try:
+        with span(f"{table_name}.delete") as stage:
+            job = client.query(
+                f"DELETE FROM {_table_path(get_table_ref(table_name))} WHERE {' AND '.join(conditions)}",
+                job_config=job_config,
+            )
+            job.result()
+            stage.add(rows=job.num_dml_affected_rows, bytes=job.total_bytes_billed, api_calls=1)
+        print_and_log(
+            f"Deleted from '{spec['table']}': {job.num_dml_affected_rows} rows affected, "
+            f"{job.total_bytes_billed} bytes billed."
+        )
+        return job
+    except GoogleAPIError as e:
+        print_and_log(f"Failed to delete data from BigQuery: {e}")
+        raise
+
+
+def write_dataframe(df, table_name, delete_missing=False, min_date=None):
+    """Write a DataFrame with the configured BQ_WRITE_MODE."""
+    if WRITE_MODE == 'truncate':
+        return load_dataframe(df, table_name)
+    return merge_dataframe(df, table_name, delete_missing=delete_missing, min_date=min_date)
+
+
+def log_bigquery_job_details(job):
+    """Log a one-line summary of a load job, failing loudly if it has errors."""
+    destination = job.destination.table_id if job.destination else 'Unknown Table'
+    print_and_log(f"Loaded {job.output_rows} rows into '{destination}' ({job.state}, {job.input_file_bytes} bytes).")
+    if job.error_result:
+        print_and_log(f"Job failed with errors: {job.error_result}")
@@ -0,0 +1,134 @@
+"""Lightweight per-stage instrumentation and one structured JSON report per run.
+
+    with span('sales.load') as stage:
+        ...
+        stage.add(rows=len(df), bytes=size, api_calls=1)
+
+Spans record wall time, the process peak RSS and rows, bytes and API calls. They are collected
+in memory and written as reports/run_<timestamp>.json by write_report() at the end of the run.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+REPORT_DIR = os.getenv('RUN_REPORT_DIR', 'reports')
+
+_lock = threading.Lock()
+_spans = []
+_local = threading.local()
+_started = time.perf_counter()
+_started_at = datetime.now(timezone.utc)
+
+
+def peak_rss_mb():
+    """Peak resident set size of the process so far, in MB (None where it cannot be read)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+class Span:
+    """One timed stage. Counters are added with add(), sub-stage times with measure()."""
+
+    __slots__ = ('name', 'parent', 'started_at', 'seconds', 'peak_rss_mb', 'rss_growth_mb',
+                 'rows', 'bytes', 'api_calls', 'stages', 'status', 'error')
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.started_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        self.seconds = None
+        self.peak_rss_mb = None
+        self.rss_growth_mb = None
+        self.rows = 0
+        self.bytes = 0
+        self.api_calls = 0
+        self.stages = {}
+        self.status = 'ok'
+        self.error = None
+
+    def add(self, rows=0, bytes=0, api_calls=0):
+        self.rows += int(rows or 0)
+        self.bytes += int(bytes or 0)
+        self.api_calls += int(api_calls or 0)
+        return self
+
+    @contextmanager
+    def measure(self, stage):
+        """Accumulate the time of a repeated sub-stage, such as parsing each page of a stream."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[stage] = round(self.stages.get(stage, 0.0) + time.perf_counter() - started, 4)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__ if getattr(self, name) not in (None, {})}
+
+
+@contextmanager
+def span(name):
+    """Time a stage and record it in the run report, nested under the current span of this thread."""
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    current = Span(name, parent=stack[-1].name if stack else None)
+    rss_before = peak_rss_mb()
+    started = time.perf_counter()
+    stack.append(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = 'error'
+        current.error = repr(e)
+        raise
+    finally:
+        stack.pop()
+        current.seconds = round(time.perf_counter() - started, 4)
+        # RSS is per process, so concurrent pipelines share the growth they cause
+        current.peak_rss_mb = peak_rss_mb()
+        if rss_before is not None:
+            current.rss_growth_mb = round(current.peak_rss_mb - rss_before, 1)
+        with _lock:
+            _spans.append(current)
+
+
+def spans():
+    with _lock:
+        return [recorded.to_dict() for recorded in _spans]
+
+
+def build_report(**extra):
+    """The run report as a dict: run timing, peak RSS, every recorded span and any extra fields."""
+    return {
+        'started_at': _started_at.isoformat(timespec='seconds'),
+        'finished_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'seconds': round(time.perf_counter() - _started, 4),
+        'argv': sys.argv,
+        'peak_rss_mb': peak_rss_mb(),
+        **extra,
+        'spans': spans(),
+    }
+
+
+def write_report(**extra):
+    """Write the run report to REPORT_DIR and return its path."""
+    report = build_report(**extra)
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    path = os.path.join(REPORT_DIR, f"run_{_started_at.strftime('%Y%m%dT%H%M%SZ')}.json")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as report_file:
+        json.dump(report, report_file, indent=2, default=str)
+    os.replace(tmp_path, path)
+    return path
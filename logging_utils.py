@@ -0,0 +1,25 @@
+import logging
+import threading
+
+# Set up logging
+# Only our own messages go to the file, the root logger is left alone so library DEBUG
+# output (urllib3, google-auth) is not written on every run. The file is opened on the
+# first message rather than at import, so runs that exit early stay cheap.
+log_file = 'script_output.log'
+logger = logging.getLogger('pipelines')
+_setup_lock = threading.Lock()
+
+def _setup_logger():
+    with _setup_lock:
+        if not logger.handlers:
+            handler = logging.FileHandler(log_file)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(handler)
+            logger.setLevel(logging.DEBUG)
+            logger.propagate = False
+
+def print_and_log(message):
+    if not logger.handlers:
+        _setup_logger()
+    print(message)
+    logger.debug(message)
@@ -0,0 +1,167 @@
+"""Re-check a trailing window of sales for refunds, chargebacks and late arrivals.
+
+    python reconcile.py --days 14
+
+The incremental sync only re-reads a short overlap before its watermark, so a transaction refunded
+a week after it was loaded would stay in the tables. This pass re-fetches the last few days from
+SumUp, diffs the successful transactions against the archived rows by transaction id, and applies
+only the difference: new or changed rows are merged and rows that are no longer successful are
+deleted, in BigQuery, the archive and the rollups alike.
+"""
+import os
+from contextlib import closing
+from datetime import datetime, time, timedelta, timezone
+
+from instrumentation import span, write_report
+from logging_utils import print_and_log
+from state_utils import load_json_state, save_json_state
+from sumup_client import SumUpClient
+from transactions import LONDON, parse_page, to_arrow
+
+# Days re-checked by each pass, 0 leaves scheduled runs incremental only
+RECONCILE_DAYS = int(os.getenv('SALES_RECONCILE_DAYS', '0'))
+
+# Scheduled runs reconcile at most this often, the syncs in between stay incremental
+RECONCILE_INTERVAL = timedelta(hours=int(os.getenv('SALES_RECONCILE_INTERVAL_HOURS', '24')))
+
+VALUE_COLUMNS = ['date', 'time', 'day_of_week', 'amount']
+
+
+def window_start(days, now=None):
+    """The first London date of the window and the UTC instant it starts at."""
+    now = now or datetime.now(timezone.utc)
+    first_date = now.astimezone(LONDON).date() - timedelta(days=days)
+    return first_date, datetime.combine(first_date, time(), tzinfo=LONDON).astimezone(timezone.utc)
+
+
+def fetch_window(client, start_date, end_date):
+    """Successful transactions in the window, and the ids SumUp returned with any other status."""
+    from TotalSales2BigQuery import iter_transaction_pages
+
+    records = []
+    other_ids = set()
+    seen_ids = set()
+    with closing(iter_transaction_pages(client, start_date, end_date)) as pages:
+        for items in pages:
+            page_records, _, _ = parse_page(items, start_date, end_date, seen_ids)
+            records.extend(page_records)
+            other_ids.update(item.get('id') for item in items if item.get('status') != 'SUCCESSFUL')
+    return records, other_ids - seen_ids
+
+
+def diff_window(fetched, stored):
+    """Rows to upsert, new or changed, and stored rows to delete because they are no longer successful."""
+    from table_schemas import coerce_to_schema
+
+    fetched = coerce_to_schema(fetched, 'sales')
+    stored = coerce_to_schema(stored, 'sales')
+    merged = fetched.merge(stored, on='transaction_id', how='outer', suffixes=('', '_stored'), indicator=True)
+
+    both = merged['_merge'] == 'both'
+    changed = merged['_merge'] == 'left_only'
+    for column in VALUE_COLUMNS:
+        # Both sides went through the same coercion, so their string forms compare like for like
+        changed |= both & (merged[column].astype(str) != merged[f"{column}_stored"].astype(str))
+
+    upserts = merged.loc[changed, fetched.columns].reset_index(drop=True)
+    deletes = merged.loc[merged['_merge'] == 'right_only', ['transaction_id', 'date_stored']]
+    return upserts, deletes.rename(columns={'date_stored': 'date'}).reset_index(drop=True)
+
+
+def apply_changes(upserts, deletes, first_date):
+    """Merge and delete the changed rows everywhere the sales are kept. Returns the earliest date changed."""
+    import archive
+    import rollups
+    from bq_loader import delete_rows, merge_dataframe
+
+    if not upserts.empty:
+        merge_dataframe(upserts, 'sales')
+        archive.append('sales', upserts)
+    if not deletes.empty:
+        delete_rows('sales', deletes['transaction_id'], first_date)
+        archive.delete('sales', deletes['transaction_id'], start=first_date)
+
+    changed_from = min(list(upserts['date']) + list(deletes['date']))
+    rollups.update_sales_rollups(rebuild_from=changed_from)
+    return changed_from
+
+
+def update_watermark(added, deleted_ids):
+    """Record the pass, and keep the sync's recent ids in step with the rows it added and removed."""
+    from TotalSales2BigQuery import OVERLAP, STATE_FILE
+
+    watermark = load_json_state(STATE_FILE, {})
+    deleted_ids = set(deleted_ids)
+    recent_ids = {tx_id: ts for tx_id, ts in watermark.get('recent_ids', {}).items() if tx_id not in deleted_ids}
+    if watermark.get('last_timestamp'):
+        # Ids inside the sync's overlap are skipped by its next fetch rather than appended twice
+        cutoff = (datetime.fromisoformat(watermark['last_timestamp']) - OVERLAP).isoformat(timespec='microseconds')
+        recent_ids.update((tx_id, ts) for tx_id, ts in added.items() if ts >= cutoff)
+    watermark.update({
+        'recent_ids': recent_ids,
+        'reconciled_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+    })
+    save_json_state(STATE_FILE, watermark)
+
+
+def reconcile(days=RECONCILE_DAYS):
+    """Re-fetch the last `days` days and apply what changed. Returns the earliest date changed, or None."""
+    import archive
+
+    api_key = os.getenv('SUMUP_API_KEY')
+    if not api_key:
+        print_and_log("API key is missing.")
+        exit(1)
+
+    first_date, start_date = window_start(days)
+    end_date = datetime.now(timezone.utc)
+    print_and_log(f"Reconciling sales from {first_date} ({days} days)")
+
+    with span('sales.reconcile') as stage:
+        with SumUpClient(api_key) as client:
+            with stage.measure('fetch'):
+                records, other_ids = fetch_window(client, start_date, end_date)
+            stage.add(api_calls=client.metrics['requests'], bytes=sum(client.metrics['bytes_per_page']))
+        with stage.measure('diff'):
+            from table_schemas import get_arrow_schema
+
+            fetched = to_arrow(records, get_arrow_schema('sales')).to_pandas()
+            stored = archive.read('sales', start=first_date)
+            upserts, deletes = diff_window(fetched, stored)
+        stage.add(rows=len(upserts) + len(deletes))
+
+    refunded = int(deletes['transaction_id'].map(lambda tx_id: tx_id in other_ids).astype(bool).sum())
+    print_and_log(
+        f"Reconciled {len(fetched)} transactions against {len(stored)} stored: {len(upserts)} to upsert, "
+        f"{len(deletes)} to delete ({refunded} no longer successful, {len(deletes) - refunded} no longer returned)."
+    )
+
+    changed_from = None
+    if not upserts.empty or not deletes.empty:
+        changed_from = apply_changes(upserts, deletes, first_date)
+    timestamps = {record.id: record.utc_timestamp for record in records}
+    update_watermark({tx_id: timestamps[tx_id] for tx_id in upserts['transaction_id']}, deletes['transaction_id'])
+    return changed_from
+
+
+def run_if_due():
+    """Reconcile from a scheduled sync when it is switched on and the last pass is older than the interval."""
+    from TotalSales2BigQuery import STATE_FILE
+
+    watermark = load_json_state(STATE_FILE)
+    if RECONCILE_DAYS <= 0 or not watermark:
+        return None
+    reconciled_at = watermark.get('reconciled_at')
+    if reconciled_at and datetime.now(timezone.utc) - datetime.fromisoformat(reconciled_at) < RECONCILE_INTERVAL:
+        return None
+    return reconcile(RECONCILE_DAYS)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Re-check recent sales for refunds and late arrivals.')
+    parser.add_argument('--days', type=int, default=RECONCILE_DAYS or 14, help='trailing days to re-check')
+    args = parser.parse_args()
+    print_and_log(f"Reconciled from {reconcile(args.days)}")
+    print_and_log(f"Run report written to {write_report()}")
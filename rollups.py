@@ -0,0 +1,216 @@
+"""Running sales rollups by hour, day and weekday, updated from each ingested batch.
+
+    python rollups.py --rebuild-from 2024-06-01 --load
+
+The state is one row per (date, hour) with the transaction count and revenue, plus a sparse
+histogram of ticket amounts per (date, hour), both under state/rollups. Everything in it is a sum,
+so the percentiles of any coarser bucket come from adding up histograms instead of re-reading
+transactions. A new batch replaces the days it touches with their aggregates from the archive,
+so folding the same batch in twice leaves the state unchanged.
+"""
+import os
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import span
+from logging_utils import print_and_log
+
+ROLLUP_DIR = os.getenv('ROLLUP_DIR', os.path.join('state', 'rollups'))
+
+# Ticket amounts are counted in fixed-width buckets, anything from HISTOGRAM_MAX up shares the last one
+BUCKET_WIDTH = 0.5
+HISTOGRAM_MAX = 200.0
+LAST_BUCKET = int(HISTOGRAM_MAX / BUCKET_WIDTH)
+
+PERCENTILES = {'p50_ticket': 0.5, 'p90_ticket': 0.9}
+
+TOTAL_COLUMNS = ['date', 'hour', 'transactions', 'revenue']
+HISTOGRAM_COLUMNS = ['date', 'hour', 'bucket', 'count']
+
+# Column types of the state, so an empty state still sums and groups like a filled one
+DTYPES = {
+    'date': 'datetime64[ns]',
+    'hour': 'int64',
+    'bucket': 'int64',
+    'count': 'int64',
+    'transactions': 'int64',
+    'revenue': 'float64',
+}
+
+
+def _state_path(name):
+    return os.path.join(ROLLUP_DIR, f"sales_{name}.parquet")
+
+
+def _empty(columns):
+    return pd.DataFrame({name: pd.Series(dtype=DTYPES[name]) for name in columns})
+
+
+def load_state():
+    """The (totals, histogram) state, empty on the first run."""
+    frames = []
+    for name, columns in (('totals', TOTAL_COLUMNS), ('histogram', HISTOGRAM_COLUMNS)):
+        path = _state_path(name)
+        if not os.path.exists(path):
+            frames.append(_empty(columns))
+            continue
+        frames.append(pd.read_parquet(path).astype({name: DTYPES[name] for name in columns}))
+    return tuple(frames)
+
+
+def save_state(totals, histogram):
+    os.makedirs(ROLLUP_DIR, exist_ok=True)
+    for name, frame in (('totals', totals), ('histogram', histogram)):
+        path = _state_path(name)
+        tmp_path = f"{path}.tmp"
+        frame.to_parquet(tmp_path, index=False, compression='zstd')
+        os.replace(tmp_path, path)
+
+
+def aggregate(df):
+    """Totals and ticket histogram per (date, hour) of transaction rows with date, time and amount."""
+    amounts = pd.to_numeric(df['amount'], errors='coerce').fillna(0).clip(lower=0)
+    rows = pd.DataFrame({
+        'date': pd.to_datetime(df['date']).dt.normalize().to_numpy(),
+        # 'HH:MM:SS' strings and datetime.time values both start with the hour
+        'hour': df['time'].astype(str).str.slice(0, 2).astype('int64').to_numpy(),
+        'bucket': np.minimum(amounts.to_numpy() // BUCKET_WIDTH, LAST_BUCKET).astype('int64'),
+        'amount': amounts.to_numpy(),
+    })
+    totals = rows.groupby(['date', 'hour'], as_index=False).agg(
+        transactions=('amount', 'size'), revenue=('amount', 'sum'))
+    histogram = rows.groupby(['date', 'hour', 'bucket'], as_index=False).agg(count=('amount', 'size'))
+    return totals, histogram
+
+
+def _combine(frames, keys, columns):
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return _empty(keys + columns)
+    return pd.concat(frames, ignore_index=True).groupby(keys, as_index=False)[columns].sum()
+
+
+def add_batch(df):
+    """Fold a batch of new transactions into the state. Returns the first date whose rollups changed.
+
+    The batch is already upserted into the archive, so its days are recomputed from there rather than
+    added on top. A run that fails after this and re-fetches the same window does not count it twice.
+    """
+    return rebuild(pd.to_datetime(df['date']).min().date())
+
+
+def rebuild(start_date):
+    """Recompute the state from start_date onwards out of the local archive, after a re-sync or correction."""
+    import archive
+
+    totals, histogram = load_state()
+    cutoff = pd.Timestamp(start_date)
+    fresh_totals, fresh_histogram = aggregate(archive.read('sales', columns=['date', 'time', 'amount'], start=start_date))
+    save_state(
+        _combine([totals[pd.to_datetime(totals['date']) < cutoff], fresh_totals], ['date', 'hour'], ['transactions', 'revenue']),
+        _combine([histogram[pd.to_datetime(histogram['date']) < cutoff], fresh_histogram],
+                 ['date', 'hour', 'bucket'], ['count']),
+    )
+    return start_date
+
+
+def estimate_percentiles(histogram, by):
+    """Percentiles of the ticket amount per group, interpolated inside the histogram bucket that holds them."""
+    counts = histogram.groupby(by + ['bucket'], as_index=False)['count'].sum().sort_values(by + ['bucket'])
+    counts['cumulative'] = counts.groupby(by)['count'].cumsum()
+    counts['total'] = counts.groupby(by)['count'].transform('sum')
+
+    result = counts[by].drop_duplicates().reset_index(drop=True)
+    for name, quantile in PERCENTILES.items():
+        target = quantile * counts['total']
+        reached = counts[counts['cumulative'] >= target].groupby(by, as_index=False).head(1)
+        reached_target = quantile * reached['total']
+        within = (reached_target - (reached['cumulative'] - reached['count'])) / reached['count']
+        value = np.minimum((reached['bucket'] + within) * BUCKET_WIDTH, HISTOGRAM_MAX).round(2)
+        result = result.merge(reached[by].assign(**{name: value.to_numpy()}), on=by, how='left')
+    return result
+
+
+def summarise(totals, histogram, by):
+    """Revenue, count, average ticket and percentiles per group of the (date, hour) state."""
+    summary = totals.groupby(by, as_index=False)[['transactions', 'revenue']].sum()
+    summary['revenue'] = summary['revenue'].round(2)
+    summary['average_ticket'] = (summary['revenue'] / summary['transactions']).round(2)
+    return summary.merge(estimate_percentiles(histogram, by), on=by, how='left')
+
+
+def build_tables(start_date=None):
+    """The hourly and daily rollups from start_date onwards (all of them when None), and the weekday rollup."""
+    totals, histogram = load_state()
+    totals = totals.assign(date=pd.to_datetime(totals['date']))
+    histogram = histogram.assign(date=pd.to_datetime(histogram['date']))
+
+    recent_totals, recent_histogram = totals, histogram
+    if start_date is not None:
+        cutoff = pd.Timestamp(start_date)
+        recent_totals, recent_histogram = totals[totals['date'] >= cutoff], histogram[histogram['date'] >= cutoff]
+
+    hourly = summarise(recent_totals, recent_histogram, ['date', 'hour'])
+    hourly.insert(2, 'day_of_week', hourly['date'].dt.day_name())
+    daily = summarise(recent_totals, recent_histogram, ['date'])
+    daily.insert(1, 'day_of_week', daily['date'].dt.day_name())
+
+    # Weekdays always cover the whole history
+    totals = totals.assign(weekday=totals['date'].dt.dayofweek + 1)
+    histogram = histogram.assign(weekday=histogram['date'].dt.dayofweek + 1)
+    weekday = summarise(totals, histogram, ['weekday'])
+    days = totals.groupby('weekday')['date'].nunique()
+    weekday.insert(0, 'day_of_week', weekday['weekday'].map(dict(enumerate(
+        ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'], start=1))))
+    weekday['days'] = weekday['weekday'].map(days).astype('int64')
+    weekday['average_daily_revenue'] = (weekday['revenue'] / weekday['days']).round(2)
+    return {'sales_hourly': hourly, 'sales_daily': daily, 'sales_weekday': weekday}
+
+
+def load_tables(tables, start_date=None):
+    """Upsert the hourly and daily rollups and replace the weekday rollup, a few hundred rows in all.
+
+    The hourly and daily tables hold every row from start_date onwards (all of them when None), so rows
+    BigQuery still has in that range, for hours or days whose sales were all removed, are deleted.
+    An empty table is still merged for that reason.
+    """
+    from bq_loader import load_dataframe, write_dataframe
+
+    for table_name in ('sales_hourly', 'sales_daily'):
+        write_dataframe(tables[table_name], table_name, delete_missing=True, min_date=start_date)
+    load_dataframe(tables['sales_weekday'], 'sales_weekday')
+
+
+def update_sales_rollups(df=None, rebuild_from=None):
+    """Fold a batch of new transactions into the rollups, or rebuild them from a date, and load the changes."""
+    from bq_loader import WRITE_MODE
+
+    with span('sales.rollups') as stage:
+        changed_from = rebuild(rebuild_from) if rebuild_from is not None else add_batch(df)
+        # Truncating loads need the full tables, merges only the days that changed
+        start_date = changed_from if WRITE_MODE == 'merge' else None
+        tables = build_tables(start_date)
+        stage.add(rows=sum(len(table) for table in tables.values()))
+    print_and_log(
+        f"Sales rollups updated from {changed_from}: {len(tables['sales_hourly'])} hourly, "
+        f"{len(tables['sales_daily'])} daily and {len(tables['sales_weekday'])} weekday rows."
+    )
+    load_tables(tables, start_date)
+    return tables
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Rebuild or show the sales rollups.')
+    parser.add_argument('--rebuild-from', type=date.fromisoformat, help='recompute from the archive from this date')
+    parser.add_argument('--load', action='store_true', help='load the rebuilt rollups into BigQuery')
+    parser.add_argument('--show', choices=['sales_hourly', 'sales_daily', 'sales_weekday'], default='sales_weekday')
+    args = parser.parse_args()
+    if args.rebuild_from and args.load:
+        update_sales_rollups(rebuild_from=args.rebuild_from)
+    elif args.rebuild_from:
+        rebuild(args.rebuild_from)
+    print(build_tables()[args.show].to_string(index=False))
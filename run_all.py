@@ -0,0 +1,107 @@
+"""Run the Sales, Bookings and Weather pipelines concurrently in one process.
+
+    python run_all.py
+    python run_all.py --only sales,weather --since 2024-06-01
+"""
+import argparse
+import importlib
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from instrumentation import span, write_report
+from logging_utils import print_and_log
+
+# Pipeline name -> module with a main(since=None) entry point
+PIPELINES = {
+    'sales': 'TotalSales2BigQuery',
+    'bookings': 'Bookings',
+    'weather': 'Weather',
+}
+
+
+def parse_only(value):
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in PIPELINES]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown pipelines {unknown}, choose from {list(PIPELINES)}")
+    return names
+
+
+def parse_since(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"--since must be YYYY-MM-DD, got {value!r}")
+
+
+def run_pipeline(name, module, since):
+    """Run one pipeline, turning any failure (including exit()) into a result instead of an exception."""
+    started = time.perf_counter()
+    try:
+        with span(name):
+            loaded_from = module.main(since=since)
+    except BaseException as e:
+        if isinstance(e, KeyboardInterrupt):
+            raise
+        print_and_log(f"[{name}] failed: {e!r}\n{traceback.format_exc()}")
+        return name, False, time.perf_counter() - started, None
+    return name, True, time.perf_counter() - started, loaded_from
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--only', type=parse_only, default=list(PIPELINES),
+                        help=f"comma-separated pipelines to run (default: {','.join(PIPELINES)})")
+    parser.add_argument('--since', type=parse_since, default=None,
+                        help='re-sync data from this date (YYYY-MM-DD) instead of the incremental window')
+    parser.add_argument('--skip-analytics', action='store_true',
+                        help='do not rebuild the analytics fact tables after loading')
+    args = parser.parse_args(argv)
+
+    # Import up front on the main thread, only the selected pipelines pay for their dependencies
+    modules = {}
+    results = []
+    for name in args.only:
+        try:
+            modules[name] = importlib.import_module(PIPELINES[name])
+        except Exception as e:
+            print_and_log(f"[{name}] failed to import: {e!r}")
+            results.append((name, False, 0.0, None))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(len(modules), 1), thread_name_prefix='pipeline') as pool:
+        futures = [pool.submit(run_pipeline, name, module, args.since) for name, module in modules.items()]
+        results.extend(future.result() for future in futures)
+
+    # Rebuild only the fact partitions from the earliest date any pipeline loaded
+    loaded_dates = [loaded_from for _, ok, _, loaded_from in results if ok and loaded_from is not None]
+    analytics_ok = True
+    if loaded_dates and not args.skip_analytics:
+        try:
+            import analytics
+            analytics.refresh_facts(min(loaded_dates))
+        except Exception as e:
+            print_and_log(f"[analytics] failed: {e!r}\n{traceback.format_exc()}")
+            analytics_ok = False
+
+    for name, ok, seconds, _ in results:
+        print_and_log(f"{name}: {'ok' if ok else 'FAILED'} in {seconds:.1f}s")
+    print_and_log(f"Total wall-clock time: {time.perf_counter() - started:.1f}s")
+    exit_code = 0 if analytics_ok and all(ok for _, ok, _, _ in results) else 1
+
+    # One structured report per run, with every pipeline's stage timings
+    report_path = write_report(
+        exit_code=exit_code,
+        pipelines={name: {'ok': ok, 'seconds': round(seconds, 4), 'loaded_from': loaded_from}
+                   for name, ok, seconds, loaded_from in results},
+        analytics_ok=analytics_ok,
+    )
+    print_and_log(f"Run report written to {report_path}")
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
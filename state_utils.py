@@ -0,0 +1,18 @@
+import json
+import os
+
+# Small JSON state files under state/ that remember where each pipeline got to between runs.
+# They are written to a temporary file and renamed, so a run killed mid-write leaves the old state intact.
+
+def load_json_state(state_path, default=None):
+    if not os.path.exists(state_path):
+        return default
+    with open(state_path) as state_file:
+        return json.load(state_file)
+
+def save_json_state(state_path, state):
+    os.makedirs(os.path.dirname(state_path) or '.', exist_ok=True)
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, 'w') as state_file:
+        json.dump(state, state_file, indent=2)
+    os.replace(tmp_path, state_path)
@@ -0,0 +1,230 @@
+import os
+import time
+import queue
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timedelta, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from logging_utils import print_and_log
+
+BASE_URL = os.getenv('SUMUP_BASE_URL', 'https://api.sumup.com/v0.1')
+
+# Connect/read timeouts in seconds for every request
+TIMEOUT = (float(os.getenv('SUMUP_CONNECT_TIMEOUT', '5')), float(os.getenv('SUMUP_READ_TIMEOUT', '30')))
+
+# Retry budget for 429/5xx responses and network errors
+MAX_RETRIES = int(os.getenv('SUMUP_MAX_RETRIES', '5'))
+BACKOFF_BASE = float(os.getenv('SUMUP_BACKOFF_BASE', '1'))
+BACKOFF_CAP = float(os.getenv('SUMUP_BACKOFF_CAP', '60'))
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Sharded backfills split the range into this many days per shard and fetch up to MAX_WORKERS at once
+SHARD_DAYS = int(os.getenv('SUMUP_SHARD_DAYS', '7'))
+MAX_WORKERS = int(os.getenv('SUMUP_MAX_WORKERS', '4'))
+
+
+def split_date_range(start_date, end_date, shard_days=SHARD_DAYS):
+    """Split [start_date, end_date] into consecutive shards of shard_days days."""
+    shards = []
+    shard_start = start_date
+    while shard_start < end_date:
+        shard_end = min(shard_start + timedelta(days=shard_days), end_date)
+        shards.append((shard_start, shard_end))
+        shard_start = shard_end
+    return shards or [(start_date, end_date)]
+
+
+# Pages buffered between the fetching threads and the consumer
+PREFETCH_PAGES = int(os.getenv('SUMUP_PREFETCH_PAGES', '4'))
+
+_DONE = object()
+
+
+class _ProducerError:
+    def __init__(self, error):
+        self.error = error
+
+
+def run_page_producers(producers, max_workers=1, depth=PREFETCH_PAGES):
+    """Run page generators on worker threads and yield their pages through a bounded queue.
+
+    The queue applies backpressure, so at most `depth` pages are held in memory while the
+    caller parses, and a failure in any producer is re-raised in the caller.
+    """
+    pages = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run(producer):
+        try:
+            for page in producer():
+                if not put(page):
+                    return
+        except Exception as e:
+            put(_ProducerError(e))
+        finally:
+            put(_DONE)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(run, producer) for producer in producers]
+        remaining = len(futures)
+        try:
+            while remaining:
+                item = pages.get()
+                if item is _DONE:
+                    remaining -= 1
+                elif isinstance(item, _ProducerError):
+                    raise item.error
+                else:
+                    yield item
+        finally:
+            # Unblock the workers if the caller stopped early or a producer failed
+            stop.set()
+            for future in futures:
+                future.cancel()
+
+
+class SumUpAPIError(Exception):
+    """Raised when SumUp cannot return a complete result, so callers never load a partial history."""
+
+
+class SumUpClient:
+    """Pooled, retrying HTTP client for the SumUp API."""
+
+    def __init__(self, api_key, base_url=BASE_URL, timeout=TIMEOUT, max_retries=MAX_RETRIES,
+                 backoff_base=BACKOFF_BASE, backoff_cap=BACKOFF_CAP, pool_size=max(MAX_WORKERS, 10)):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+        # One session keeps the TCP/TLS connection alive across pages
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Authorization': f'Bearer {api_key}'})
+
+        self._metrics_lock = threading.Lock()
+        self.metrics = {'requests': 0, 'retries': 0, 'pages': 0, 'bytes_per_page': []}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def _record(self, key, value=1):
+        with self._metrics_lock:
+            if isinstance(self.metrics[key], list):
+                self.metrics[key].append(value)
+            else:
+                self.metrics[key] += value
+
+    def _retry_delay(self, attempt, response=None):
+        # Honour Retry-After when the server sends one, either as seconds or an HTTP date
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_cap)
+            except ValueError:
+                try:
+                    retry_at = parsedate_to_datetime(retry_after)
+                    return min(max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0), self.backoff_cap)
+                except (TypeError, ValueError):
+                    pass
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def get_json(self, url, params=None):
+        """GET a SumUp endpoint, retrying throttled and transient failures."""
+        attempt = 0
+        while True:
+            self._record('requests')
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise SumUpAPIError(f"Request to {url} failed after {attempt + 1} attempts: {e}") from e
+                delay = self._retry_delay(attempt)
+                print_and_log(f"Request to {url} failed ({e}), retrying in {delay:.1f}s")
+            else:
+                if response.status_code == 200:
+                    self._record('pages')
+                    self._record('bytes_per_page', len(response.content))
+                    return response.json()
+                if response.status_code not in RETRYABLE_STATUS_CODES or attempt >= self.max_retries:
+                    raise SumUpAPIError(
+                        f"Failed to retrieve {url}. Status code: {response.status_code}. Response: {response.text}"
+                    )
+                delay = self._retry_delay(attempt, response)
+                print_and_log(f"SumUp returned {response.status_code}, retrying in {delay:.1f}s")
+
+            self._record('retries')
+            attempt += 1
+            time.sleep(delay)
+
+    def iter_transaction_pages(self, start_date, end_date):
+        """Yield each page of transaction history items between two dates."""
+        endpoint = f'{self.base_url}/me/transactions/history'
+        params = {'from': start_date.strftime('%Y-%m-%d'), 'to': end_date.strftime('%Y-%m-%d')}
+
+        while True:
+            transactions_response = self.get_json(endpoint, params=params)
+            if 'items' not in transactions_response:
+                raise SumUpAPIError("The 'items' key was not found in the response.")
+            yield transactions_response['items']
+
+            next_link = next((link for link in transactions_response.get('links', []) if link['rel'] == 'next'), None)
+            if not next_link:
+                break
+            # Properly construct the full URL for the next request
+            endpoint = f"{self.base_url}/me/transactions/history?{next_link['href']}"
+            params = None  # Clear params to avoid duplication in the URL
+
+    def latest_transaction(self):
+        """The newest transaction in the history, or None when there is none, in one small request."""
+        endpoint = f'{self.base_url}/me/transactions/history'
+        items = self.get_json(endpoint, params={'order': 'descending', 'limit': 1}).get('items', [])
+        return items[0] if items else None
+
+    def iter_transaction_pages_prefetched(self, start_date, end_date, depth=PREFETCH_PAGES):
+        """Like iter_transaction_pages, but the next pages are fetched while the caller parses."""
+        return run_page_producers([lambda: self.iter_transaction_pages(start_date, end_date)], 1, depth)
+
+    def iter_transaction_pages_sharded(self, start_date, end_date, shard_days=SHARD_DAYS,
+                                       max_workers=MAX_WORKERS, depth=PREFETCH_PAGES):
+        """Yield pages from date shards fetched on a bounded thread pool, in completion order.
+
+        Shards share their boundary day, so callers must de-duplicate by transaction id.
+        """
+        shards = split_date_range(start_date, end_date, shard_days)
+        print_and_log(f"Fetching {len(shards)} shards of {shard_days} days with {max_workers} workers.")
+        producers = [lambda shard=shard: self.iter_transaction_pages(*shard) for shard in shards]
+        return run_page_producers(producers, max_workers, max(depth, max_workers))
+
+    def log_metrics(self):
+        page_bytes = self.metrics['bytes_per_page']
+        print_and_log(
+            f"SumUp requests: {self.metrics['requests']}, retries: {self.metrics['retries']}, "
+            f"pages: {self.metrics['pages']}, bytes: {sum(page_bytes)} "
+            f"(avg {sum(page_bytes) // max(len(page_bytes), 1)} per page)"
+        )
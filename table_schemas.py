@@ -0,0 +1,181 @@
+"""Table schemas shared by the BigQuery loader and the local archive, without any cloud dependency."""
+import pandas as pd
+import pyarrow as pa
+
+from logging_utils import print_and_log
+
+# Destination, schema, natural keys, partition column and row order of every table we load, declared once
+TABLES = {
+    'sales': {
+        'dataset': 'TotalSales',
+        'table': 'TotalSalesTable',
+        'schema': [
+            ('date', 'DATE'),
+            ('time', 'TIME'),
+            ('day_of_week', 'STRING'),
+            ('amount', 'FLOAT64'),
+            ('transaction_id', 'STRING'),
+        ],
+        'keys': ['transaction_id'],
+        'partition_field': 'date',
+        'order_by': ['date', 'time'],
+    },
+    'bookings': {
+        'dataset': 'Bookings',
+        'table': 'BookingsTable',
+        'schema': [
+            ('Date', 'DATE'),
+            ('Time', 'TIME'),
+            ('Adult', 'INTEGER'),
+            ('Child', 'INTEGER'),
+            ('Under_4', 'INTEGER'),
+            ('Name', 'STRING'),
+            ('Contact', 'STRING'),
+        ],
+        'keys': ['Date', 'Time', 'Name'],
+        'partition_field': 'Date',
+        'order_by': ['Date', 'Time'],
+        # Separate bookings in the same slot under the same (or no) name are one row with their covers added
+        'sum_columns': ['Adult', 'Child', 'Under_4'],
+    },
+    'weather': {
+        'dataset': 'Weather',
+        'table': 'WeatherTable',
+        'schema': [
+            ('date', 'DATE'),
+            ('time', 'TIME'),
+            ('temperature', 'FLOAT64'),
+            ('rain', 'FLOAT64'),
+            ('wind_speed', 'FLOAT64'),
+            ('location', 'STRING'),
+        ],
+        'keys': ['location', 'date', 'time'],
+        'partition_field': 'date',
+        'order_by': ['location', 'date', 'time'],
+        # Rows loaded before there were several sites are all from Brighton
+        'defaults': {'location': 'brighton'},
+    },
+    # Sales rollups maintained by rollups.py
+    'sales_hourly': {
+        'dataset': 'TotalSales',
+        'table': 'SalesHourlyRollup',
+        'schema': [
+            ('date', 'DATE'),
+            ('hour', 'INTEGER'),
+            ('day_of_week', 'STRING'),
+            ('transactions', 'INTEGER'),
+            ('revenue', 'FLOAT64'),
+            ('average_ticket', 'FLOAT64'),
+            ('p50_ticket', 'FLOAT64'),
+            ('p90_ticket', 'FLOAT64'),
+        ],
+        'keys': ['date', 'hour'],
+        'partition_field': 'date',
+        'order_by': ['date', 'hour'],
+    },
+    'sales_daily': {
+        'dataset': 'TotalSales',
+        'table': 'SalesDailyRollup',
+        'schema': [
+            ('date', 'DATE'),
+            ('day_of_week', 'STRING'),
+            ('transactions', 'INTEGER'),
+            ('revenue', 'FLOAT64'),
+            ('average_ticket', 'FLOAT64'),
+            ('p50_ticket', 'FLOAT64'),
+            ('p90_ticket', 'FLOAT64'),
+        ],
+        'keys': ['date'],
+        'partition_field': 'date',
+        'order_by': ['date'],
+    },
+    # Seven rows, always replaced whole
+    'sales_weekday': {
+        'dataset': 'TotalSales',
+        'table': 'SalesWeekdayRollup',
+        'schema': [
+            ('day_of_week', 'STRING'),
+            ('weekday', 'INTEGER'),
+            ('days', 'INTEGER'),
+            ('transactions', 'INTEGER'),
+            ('revenue', 'FLOAT64'),
+            ('average_ticket', 'FLOAT64'),
+            ('p50_ticket', 'FLOAT64'),
+            ('p90_ticket', 'FLOAT64'),
+            ('average_daily_revenue', 'FLOAT64'),
+        ],
+        'keys': ['weekday'],
+        'partition_field': None,
+        'order_by': ['weekday'],
+    },
+}
+
+
+ARROW_TYPES = {
+    'DATE': pa.date32(),
+    'TIME': pa.time64('us'),
+    'STRING': pa.string(),
+    'FLOAT64': pa.float64(),
+    'INTEGER': pa.int64(),
+}
+
+
+def get_arrow_schema(table_name):
+    """Arrow schema matching the table, for writing Parquet files BigQuery loads as-is."""
+    return pa.schema([(name, ARROW_TYPES[field_type]) for name, field_type in TABLES[table_name]['schema']])
+
+
+def coerce_to_schema(df, table_name):
+    """Project a DataFrame onto the table schema with the column types BigQuery expects."""
+    columns = {}
+    defaults = TABLES[table_name].get('defaults', {})
+    for name, field_type in TABLES[table_name]['schema']:
+        # Frames written before a column was added take its default
+        column = df[name] if name in df.columns or name not in defaults else pd.Series(defaults[name], index=df.index)
+        if field_type == 'DATE':
+            column = pd.to_datetime(column).dt.date
+        elif field_type == 'TIME':
+            if column.map(lambda value: isinstance(value, str)).any():
+                column = pd.to_datetime(column, format='%H:%M:%S').dt.time
+        elif field_type == 'FLOAT64':
+            column = pd.to_numeric(column, errors='coerce').astype('float64')
+        elif field_type == 'INTEGER':
+            column = pd.to_numeric(column, errors='coerce').astype('Int64')
+        elif field_type == 'STRING':
+            column = column.astype('string')
+        columns[name] = column
+    return pd.DataFrame(columns)
+
+
+def min_partition_date(data, table_name):
+    """Earliest partition date in a DataFrame or a Parquet file written with the table schema."""
+    partition_field = TABLES[table_name]['partition_field']
+    if isinstance(data, str):
+        data = pd.read_parquet(data, columns=[partition_field])
+    dates = pd.to_datetime(data[partition_field]).dropna()
+    return dates.min().date() if not dates.empty else None
+
+
+def combine_duplicate_keys(df, table_name):
+    """Collapse rows that share the table's natural keys into one, as a MERGE or an upsert needs.
+
+    The table's sum_columns are added up and every other column takes the last row's value,
+    so no counts are lost. The number of rows combined is logged.
+    """
+    spec = TABLES[table_name]
+    keys = spec['keys']
+    duplicated = df.duplicated(subset=keys, keep=False)
+    if not duplicated.any():
+        return df
+
+    rows = df[duplicated]
+    combined = rows.drop_duplicates(subset=keys, keep='last')
+    sum_columns = spec.get('sum_columns', [])
+    if sum_columns:
+        totals = rows.groupby(keys, dropna=False, sort=False)[sum_columns].sum(min_count=1).reset_index()
+        combined = combined.drop(columns=sum_columns).merge(totals, on=keys, how='left')[list(df.columns)]
+    print_and_log(
+        f"Combined {len(rows)} '{spec['table']}' rows sharing {keys} into {len(combined)}"
+        + (f", adding up {sum_columns}." if sum_columns else ', keeping the last of each.')
+    )
+    return pd.concat([df[~duplicated], combined], ignore_index=True)
@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+# The pipelines are top-level modules in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Run every test in an empty directory, so state/, archive/ and the log never touch the checkout."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def bigquery_client(monkeypatch):
+    """The recording BigQuery stand-in from the benchmarks, in place of the real client."""
+    import bq_loader
+    from benchmarks.fakes import RecordingBigQueryClient
+
+    client = RecordingBigQueryClient()
+    monkeypatch.setattr(bq_loader, 'get_client', lambda: client)
+    return client
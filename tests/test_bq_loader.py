@@ -0,0 +1,60 @@
+from datetime import date
+
+import pandas as pd
+
+import bq_loader
+from table_schemas import coerce_to_schema, combine_duplicate_keys
+
+
+def test_merge_sql_limits_matches_and_deletes_to_partitions_from_min_date(bigquery_client):
+    sql = bq_loader.build_merge_sql('sales_daily', min_date=date(2024, 6, 2), delete_missing=True)
+
+    assert sql.startswith('MERGE `bench-project.TotalSales.SalesDailyRollup` T\n')
+    assert 'USING `bench-project.TotalSales.SalesDailyRollup_staging` S' in sql
+    assert "AND T.date >= DATE '2024-06-02'\n" in sql
+    assert sql.endswith("WHEN NOT MATCHED BY SOURCE AND T.date >= DATE '2024-06-02' THEN DELETE")
+
+
+def test_merge_sql_without_delete_missing_never_deletes(bigquery_client):
+    sql = bq_loader.build_merge_sql('sales', min_date=date(2024, 6, 2))
+    assert 'DELETE' not in sql
+    assert 'WHEN MATCHED AND (' in sql and 'WHEN NOT MATCHED THEN INSERT' in sql
+
+
+def test_merge_sql_without_min_date_scans_every_partition(bigquery_client):
+    sql = bq_loader.build_merge_sql('sales_daily', delete_missing=True)
+    assert 'DATE' not in sql.split('ON ', 1)[1].split('\n', 1)[0]
+    assert sql.endswith('WHEN NOT MATCHED BY SOURCE THEN DELETE')
+
+
+def test_merge_dataframe_uses_the_given_min_date_for_an_empty_frame(bigquery_client):
+    empty = pd.DataFrame(columns=[name for name, _ in bq_loader.TABLES['sales_daily']['schema']])
+    bq_loader.merge_dataframe(empty, 'sales_daily', delete_missing=True, min_date=date(2024, 6, 2))
+    (sql,) = bigquery_client.queries
+    assert sql.endswith("WHEN NOT MATCHED BY SOURCE AND T.date >= DATE '2024-06-02' THEN DELETE")
+
+
+def test_delete_rows_filters_on_the_key_and_partition(bigquery_client):
+    bq_loader.delete_rows('sales', ['a', 'b'], min_date=date(2024, 6, 1))
+    (sql,) = bigquery_client.queries
+    assert sql == (
+        "DELETE FROM `bench-project.TotalSales.TotalSalesTable` "
+        "WHERE transaction_id IN UNNEST(@key_values) AND date >= DATE '2024-06-01'"
+    )
+
+
+def test_bookings_sharing_a_key_keep_their_covers():
+    bookings = coerce_to_schema(pd.DataFrame({
+        'Date': ['2024-06-01'] * 3,
+        'Time': ['10:00:00'] * 3,
+        'Adult': [2, 1, 3],
+        'Child': [1, 0, 0],
+        'Under_4': [0, 1, 0],
+        'Name': ['', '', 'Sam'],
+        'Contact': ['Walk In', 'Walk In', 'Call'],
+    }), 'bookings')
+
+    combined = combine_duplicate_keys(bookings, 'bookings').set_index('Name')
+    assert len(combined) == 2
+    assert combined.loc['', ['Adult', 'Child', 'Under_4']].tolist() == [3, 1, 1]
+    assert combined.loc['Sam', 'Adult'] == 3
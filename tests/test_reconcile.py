@@ -0,0 +1,54 @@
+from datetime import date
+
+import pandas as pd
+
+import archive
+from reconcile import apply_changes, diff_window
+
+
+def sales(*rows):
+    return pd.DataFrame(rows, columns=['date', 'time', 'day_of_week', 'amount', 'transaction_id'])
+
+
+STORED = sales(
+    ('2024-06-01', '10:00:00', 'Saturday', 5.0, 'unchanged'),
+    ('2024-06-01', '11:00:00', 'Saturday', 7.0, 'changed'),
+    ('2024-06-02', '12:00:00', 'Sunday', 4.0, 'refunded'),
+)
+
+
+def test_diff_window_upserts_new_and_changed_rows_and_deletes_missing_ones():
+    fetched = sales(
+        ('2024-06-01', '10:00:00', 'Saturday', 5.0, 'unchanged'),
+        ('2024-06-01', '11:00:00', 'Saturday', 7.5, 'changed'),
+        ('2024-06-02', '13:00:00', 'Sunday', 3.0, 'late'),
+    )
+    upserts, deletes = diff_window(fetched, STORED)
+
+    assert sorted(upserts['transaction_id']) == ['changed', 'late']
+    assert upserts.set_index('transaction_id').loc['changed', 'amount'] == 7.5
+    assert list(deletes['transaction_id']) == ['refunded']
+    assert list(deletes['date']) == [date(2024, 6, 2)]
+
+
+def test_diff_window_is_empty_when_nothing_changed():
+    upserts, deletes = diff_window(STORED, STORED)
+    assert upserts.empty and deletes.empty
+
+
+def test_apply_changes_removes_refunds_everywhere(workdir, bigquery_client):
+    import rollups
+
+    archive.append('sales', STORED)
+    rollups.rebuild(date(2024, 6, 1))
+    upserts, deletes = diff_window(STORED[STORED['transaction_id'] != 'refunded'], STORED)
+
+    assert apply_changes(upserts, deletes, date(2024, 6, 1)) == date(2024, 6, 2)
+
+    assert sorted(archive.read('sales')['transaction_id']) == ['changed', 'unchanged']
+    statements = bigquery_client.queries
+    assert any(sql.startswith('DELETE FROM') and "date >= DATE '2024-06-01'" in sql for sql in statements)
+    # The emptied day is deleted from the daily rollup rather than left behind
+    assert any('SalesDailyRollup` T' in sql and "NOT MATCHED BY SOURCE AND T.date >= DATE '2024-06-02'" in sql
+               for sql in statements)
+    assert list(rollups.build_tables()['sales_daily']['transactions']) == [2]
@@ -0,0 +1,68 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+import archive
+import rollups
+
+BATCH = pd.DataFrame({
+    'date': ['2024-06-01', '2024-06-01', '2024-06-01', '2024-06-02'],
+    'time': ['10:00:00', '11:00:00', '11:30:00', '12:00:00'],
+    'day_of_week': ['Saturday', 'Saturday', 'Saturday', 'Sunday'],
+    'amount': [5.0, 7.0, 9.0, 4.0],
+    'transaction_id': ['a', 'b', 'c', 'd'],
+})
+
+
+def daily():
+    return rollups.build_tables()['sales_daily'].set_index('date')[['transactions', 'revenue']]
+
+
+def test_folding_the_same_batch_twice_counts_it_once(workdir):
+    # The ingest archives a batch before folding it in, a retried run does both again
+    for _ in range(2):
+        archive.append('sales', BATCH)
+        assert rollups.add_batch(BATCH) == date(2024, 6, 1)
+
+    totals = daily()
+    assert totals.loc[pd.Timestamp('2024-06-01')].tolist() == [3, 21.0]
+    assert totals.loc[pd.Timestamp('2024-06-02')].tolist() == [1, 4.0]
+
+
+def test_percentiles_come_from_the_histogram(workdir):
+    archive.append('sales', BATCH)
+    rollups.add_batch(BATCH)
+    saturday = rollups.build_tables()['sales_daily'].iloc[0]
+    assert saturday['average_ticket'] == 7.0
+    assert saturday['p50_ticket'] == pytest.approx(7.0, abs=rollups.BUCKET_WIDTH)
+
+
+def test_empty_state_builds_empty_tables(workdir):
+    tables = rollups.build_tables()
+    assert all(table.empty for table in tables.values())
+
+
+def test_rebuild_after_every_sale_is_deleted(workdir):
+    archive.append('sales', BATCH)
+    rollups.add_batch(BATCH)
+    archive.delete('sales', BATCH['transaction_id'])
+
+    rollups.rebuild(date(2024, 6, 1))
+    tables = rollups.build_tables(date(2024, 6, 1))
+    assert all(table.empty for table in tables.values())
+
+
+def test_empty_rebuilt_range_is_still_merged_with_deletes(workdir, bigquery_client, monkeypatch):
+    import bq_loader
+
+    monkeypatch.setattr(bq_loader, 'WRITE_MODE', 'merge')
+    archive.append('sales', BATCH)
+    rollups.add_batch(BATCH)
+    archive.delete('sales', ['d'])
+
+    tables = rollups.update_sales_rollups(rebuild_from=date(2024, 6, 2))
+    assert tables['sales_daily'].empty
+    merges = [sql for sql in bigquery_client.queries if sql.startswith('MERGE')]
+    assert len(merges) == 2
+    assert all("WHEN NOT MATCHED BY SOURCE AND T.date >= DATE '2024-06-02' THEN DELETE" in sql for sql in merges)
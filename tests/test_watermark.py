@@ -0,0 +1,78 @@
+import pytest
+
+from benchmarks.mock_sumup import MockSumUpServer
+from sumup_client import SumUpClient
+from TotalSales2BigQuery import advance_watermark, has_new_transactions, parse_timestamp
+
+
+class LatestOnly:
+    """A client whose newest transaction is fixed."""
+
+    def __init__(self, latest):
+        self.latest = latest
+
+    def latest_transaction(self):
+        return self.latest
+
+
+def item(tx_id, timestamp, status='SUCCESSFUL'):
+    return {'id': tx_id, 'timestamp': timestamp, 'status': status}
+
+
+def watermark_after(*items, uploaded=()):
+    """The watermark a run leaves after fetching items and uploading the successful ones named in uploaded."""
+    newest = max(items, key=lambda i: parse_timestamp(i['timestamp']))
+    return advance_watermark(
+        None,
+        (parse_timestamp(newest['timestamp']), newest['id'], newest['status']),
+        {i['id']: parse_timestamp(i['timestamp']) for i in items if i['id'] in uploaded},
+    )
+
+
+def test_advance_watermark_follows_newest_item_of_any_status():
+    watermark = watermark_after(item('a', '2024-06-01T10:00:00Z'), item('b', '2024-06-01T11:00:00Z', 'FAILED'),
+                                uploaded={'a'})
+    assert watermark['last_timestamp'] == '2024-06-01T11:00:00.000000+00:00'
+    assert watermark['last_transaction_id'] == 'b'
+    assert watermark['last_status'] == 'FAILED'
+    assert set(watermark['recent_ids']) == {'a'}
+
+
+def test_advance_watermark_never_moves_back():
+    watermark = watermark_after(item('b', '2024-06-01T11:00:00Z'), uploaded={'b'})
+    older = advance_watermark(watermark, (parse_timestamp('2024-06-01T09:00:00Z'), 'z', 'SUCCESSFUL'), {})
+    assert older['last_transaction_id'] == 'b'
+    assert older['last_timestamp'] == watermark['last_timestamp']
+
+
+@pytest.mark.parametrize('status', ['FAILED', 'PENDING', 'REFUNDED'])
+def test_probe_ignores_a_non_successful_newest_item_it_has_seen(status):
+    newest = item('b', '2024-06-01T11:00:00Z', status)
+    watermark = watermark_after(item('a', '2024-06-01T10:00:00Z'), newest, uploaded={'a'})
+    assert not has_new_transactions(LatestOnly(newest), watermark)
+
+
+def test_probe_sees_a_newer_transaction():
+    watermark = watermark_after(item('a', '2024-06-01T10:00:00Z'), uploaded={'a'})
+    assert has_new_transactions(LatestOnly(item('b', '2024-06-01T10:00:01Z')), watermark)
+
+
+def test_probe_sees_another_transaction_at_the_same_instant():
+    watermark = watermark_after(item('a', '2024-06-01T10:00:00Z'), uploaded={'a'})
+    assert has_new_transactions(LatestOnly(item('c', '2024-06-01T10:00:00Z')), watermark)
+
+
+def test_probe_sees_a_pending_transaction_settle():
+    watermark = watermark_after(item('a', '2024-06-01T10:00:00Z'), item('b', '2024-06-01T11:00:00Z', 'PENDING'),
+                                uploaded={'a'})
+    assert has_new_transactions(LatestOnly(item('b', '2024-06-01T11:00:00Z', 'SUCCESSFUL')), watermark)
+
+
+def test_probe_against_the_mock_server():
+    # With 41 a day the mock's newest transaction is a failed one
+    with MockSumUpServer(per_day=41, latency=0) as server, SumUpClient('test', base_url=server.base_url) as client:
+        latest = client.latest_transaction()
+        assert latest['status'] == 'FAILED'
+        watermark = watermark_after(latest)
+        assert not has_new_transactions(client, watermark)
+        assert server.requests == 2
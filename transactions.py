@@ -0,0 +1,105 @@
+"""Typed SumUp transaction records, parsed straight from the API items.
+
+Only the four fields the sales table needs are read. Items are filtered on status, date range and
+id while they are parsed, so the raw dicts of a page can be dropped as soon as it is read.
+"""
+import math
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+LONDON = ZoneInfo('Europe/London')
+
+DAY_NAMES = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+
+
+class InvalidTransaction(ValueError):
+    """Raised for an item missing a usable id, timestamp or amount."""
+
+
+class Transaction:
+    """One successful transaction: id, UTC timestamp, status and amount."""
+
+    __slots__ = ('id', 'timestamp', 'status', 'amount')
+
+    def __init__(self, id, timestamp, status, amount):
+        self.id = id
+        self.timestamp = timestamp
+        self.status = status
+        self.amount = amount
+
+    def __repr__(self):
+        return f"Transaction({self.id!r}, {self.timestamp.isoformat()}, {self.status!r}, {self.amount})"
+
+    @property
+    def utc_timestamp(self):
+        """Sortable UTC ISO string, the format the sync watermark stores."""
+        return self.timestamp.isoformat(timespec='microseconds')
+
+
+def parse_utc(value):
+    """A SumUp ISO 8601 timestamp as an aware UTC datetime, naive values are taken as UTC."""
+    if not isinstance(value, str) or not value:
+        raise InvalidTransaction(f"invalid timestamp {value!r}")
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except ValueError:
+        raise InvalidTransaction(f"invalid timestamp {value!r}")
+    return timestamp.astimezone(timezone.utc) if timestamp.tzinfo else timestamp.replace(tzinfo=timezone.utc)
+
+
+def parse_transaction(item, timestamp=None):
+    """Validate one API item into a Transaction, raising InvalidTransaction when it is malformed."""
+    tx_id = item.get('id')
+    if not isinstance(tx_id, str) or not tx_id:
+        raise InvalidTransaction(f"invalid id {tx_id!r}")
+    amount = item.get('amount')
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)) or not math.isfinite(amount):
+        raise InvalidTransaction(f"invalid amount {amount!r} for {tx_id}")
+    return Transaction(tx_id, timestamp or parse_utc(item.get('timestamp')), item.get('status'), float(amount))
+
+
+def parse_page(items, start_date, end_date, seen_ids, statuses=('SUCCESSFUL',)):
+    """Parse a page of API items into new Transactions, skipping other statuses, dates and seen ids.
+
+    Accepted ids are added to seen_ids, so duplicates within and across pages are dropped in O(1) each.
+    Returns the records, the newest (timestamp, id, status) of any item, and the number of malformed items.
+    """
+    records = []
+    newest = None
+    rejected = 0
+    for item in items:
+        try:
+            timestamp = parse_utc(item.get('timestamp'))
+        except InvalidTransaction:
+            rejected += 1
+            continue
+        # The watermark follows every item SumUp returns, whatever its status
+        if newest is None or timestamp > newest[0]:
+            newest = (timestamp, item.get('id'), item.get('status'))
+
+        if item.get('status') not in statuses or not start_date <= timestamp <= end_date:
+            continue
+        try:
+            record = parse_transaction(item, timestamp)
+        except InvalidTransaction:
+            rejected += 1
+            continue
+        if record.id in seen_ids:
+            continue
+        seen_ids.add(record.id)
+        records.append(record)
+    return records, newest, rejected
+
+
+def to_arrow(records, schema):
+    """Columnar Arrow table of records with the sales table's schema, in London local time."""
+    import pyarrow as pa
+
+    local_times = [record.timestamp.astimezone(LONDON) for record in records]
+    return pa.Table.from_pydict({
+        'date': [local.date() for local in local_times],
+        'time': [local.time().replace(microsecond=0) for local in local_times],
+        'day_of_week': [DAY_NAMES[local.weekday()] for local in local_times],
+        'amount': [record.amount for record in records],
+        'transaction_id': [record.id for record in records],
+    }, schema=schema)